@@ -26,6 +26,7 @@ setup(
     description="Record and monitor video on android devices from computer (currently Linux via USB).",
     keywords=["android", "linux", "usb", "remote", "adb", "video", "movie", "record", "monitor"],
     install_requires=["wheel"],
+    extras_require={"analysis": ["numpy"]}, # For the --analyze-audio option.
     python_requires=">=3.6",
     entry_points = {
         "console_scripts": ["recdroidvid = recdroidvid.recdroidvid_main:main"]
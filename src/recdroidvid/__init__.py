@@ -1,3 +1,4 @@
 
 from . import recdroidvid_main
+from .hooks import register_hook
 
@@ -5,26 +5,97 @@ Commands calling the Android Debug Bridge (ADB) to the moblie device.
 """
 
 import sys
-from time import sleep
-from .settings_and_options import args
+import os
+import subprocess
+import signal
+import hashlib
+import threading
+from time import sleep, monotonic
+from .settings_and_options import (args, STREAM_PULL_BLOCK_SIZE, ADB_CMD_TIMEOUT,
+                ADB_RETRIES, ADB_RETRY_BACKOFF, ADB_UNREACHED_ERROR_STRINGS,
+                ADB_TRANSIENT_ERROR_STRINGS, ADB_WAIT_FOR_DEVICE_TIMEOUT,
+                ADB_TRANSFER_STALL_TIMEOUT, CIRCUIT_BREAKER_MAX_FAILURES, CIRCUIT_BREAKER_PAUSE_TIME)
 from .utility_functions import run_local_cmd_blocking
 
-def adb(cmd, *, print_cmd=True):
-    """Run the ADB command, printing out diagnostics.  Setting `return_output`
-    returns the stdout of the command, but the command must be redirectable to
-    a temp file.  Returned string is a direct read, with no splitting."""
-    returncode, stdout, stderr = run_local_cmd_blocking(cmd, print_cmd=print_cmd,
-                                                        print_cmd_prefix="ADB: ",
-                                                        fail_on_nonzero_exit=False)
+class AdbError(Exception):
+    """Raised when an ADB command fails, after any retries."""
+    pass
+
+screen_monitor_running = False # Set while scrcpy is up, since `adb reconnect` kills it.
+
+def recover_adb_connection(reconnect):
+    """Try to recover the connection by waiting for the device, first reconnecting
+    if `reconnect` is true and the screen monitor is not running.  Failures are
+    ignored; the retried command will report them."""
+    if reconnect and not screen_monitor_running:
+        run_local_cmd_blocking("adb reconnect", fail_on_nonzero_exit=False,
+                               timeout=ADB_CMD_TIMEOUT)
+    run_local_cmd_blocking("adb wait-for-device", fail_on_nonzero_exit=False,
+                           timeout=ADB_WAIT_FOR_DEVICE_TIMEOUT)
+
+def adb(cmd, *, print_cmd=True, timeout=ADB_CMD_TIMEOUT, idempotent=True):
+    """Run the ADB command, printing out diagnostics.  Returns the stdout and
+    stderr of the command.  Returned strings are a direct read, with no splitting.
+
+    The command is killed if it runs longer than `timeout` seconds (`None` for no
+    limit).  Transient failures such as a dropped USB connection or a timeout are
+    retried with exponential backoff, after waiting for the device.  Only failures
+    which show the device was unreached try `adb reconnect` first, and never while
+    the screen monitor is running.
+    Commands which are not `idempotent` (such as a button press) are only retried
+    when the failure shows they never reached the device.  Raises `AdbError` if
+    the command still fails."""
+    for attempt in range(ADB_RETRIES + 1):
+        returncode, stdout, stderr = run_local_cmd_blocking(cmd, print_cmd=print_cmd,
+                                                            print_cmd_prefix="ADB: ",
+                                                            fail_on_nonzero_exit=False,
+                                                            timeout=timeout)
+        if returncode == 0:
+            return stdout, stderr
+
+        unreached = any(e in stderr for e in ADB_UNREACHED_ERROR_STRINGS)
+        transient = returncode is None or any(e in stderr for e in ADB_TRANSIENT_ERROR_STRINGS)
+        if attempt == ADB_RETRIES or not (unreached or (transient and idempotent)):
+            break
+        delay = ADB_RETRY_BACKOFF * 2**attempt
+        print(f"\nWARNING: ADB command '{cmd}' failed, retrying in {delay:g} s:"
+              f"\n   {stderr.strip()}", file=sys.stderr)
+        sleep(delay)
+        recover_adb_connection(reconnect=unreached)
+
     if stderr.startswith("error: no devices"):
-        print("\nERROR: No devices found, is the phone plugged in via USB?", file=sys.stderr)
-        sys.exit(1)
-    elif returncode != 0:
-        print(f"\nERROR: ADB command '{cmd}' returned nonzero exit status '{returncode}'."
-                f"\nThe command's output follows:\n{stdout}\n{stderr}",
-                file=sys.stderr)
-        sys.exit(1)
-    return stdout, stderr
+        raise AdbError("No devices found, is the phone plugged in via USB?")
+    status = "timed out" if returncode is None else f"returned nonzero exit status '{returncode}'"
+    raise AdbError(f"ADB command '{cmd}' {status}."
+                   f"\nThe command's output follows:\n{stdout}\n{stderr}")
+
+#
+# Circuit breakers, to pause optional background features whose ADB commands keep
+# failing rather than stopping the whole session.
+#
+
+circuit_breaker_failures = {} # Consecutive failure counts, keyed by feature name.
+circuit_breaker_paused_until = {} # Monotonic times when paused features resume.
+
+def feature_available(feature):
+    """Return false while the named feature is paused by its circuit breaker."""
+    return monotonic() >= circuit_breaker_paused_until.get(feature, 0)
+
+def record_feature_success(feature):
+    """Reset the circuit breaker failure count for the named feature."""
+    circuit_breaker_failures[feature] = 0
+
+def record_feature_failure(feature, error):
+    """Count a failure of the named feature, pausing the feature for a while when
+    there are too many in a row."""
+    print(f"\nWARNING: {feature} failed: {error}", file=sys.stderr)
+    failures = circuit_breaker_failures.get(feature, 0) + 1
+    circuit_breaker_failures[feature] = failures
+    if failures >= CIRCUIT_BREAKER_MAX_FAILURES:
+        print(f"\nWARNING: Pausing {feature} for {CIRCUIT_BREAKER_PAUSE_TIME} s after"
+              f" {failures} failures in a row.", file=sys.stderr)
+        circuit_breaker_paused_until[feature] = monotonic() + CIRCUIT_BREAKER_PAUSE_TIME
+        circuit_breaker_failures[feature] = 0
 
 def ls(path, also_hidden=False, extension_whitelist=None, print_cmd=True):
     """Run the ADB ls command and return the filenames time-sorted from oldest
@@ -47,7 +118,7 @@ def ls(path, also_hidden=False, extension_whitelist=None, print_cmd=True):
 def tap_screen(x, y):
     """Generate a screen tap at the given position."""
     #https://stackoverflow.com/questions/3437686/how-to-use-adb-to-send-touch-events-to-device-using-sendevent-command
-    adb(f"adb shell input tap {x} {y}")
+    adb(f"adb shell input tap {x} {y}", idempotent=False)
 
 def force_stop_opencamera():
     """Issue a force-stop command to OpenCamera app.  Note this made the Google
@@ -56,11 +127,11 @@ def force_stop_opencamera():
 
 def tap_camera_button():
     """Tap the button in the camera to start it or stop it from recording."""
-    adb(f"adb shell input keyevent 27")
+    adb(f"adb shell input keyevent 27", idempotent=False)
 
 def toggle_power():
     """Toggle the power.  See also the `device_wakeup` function."""
-    adb("adb shell input keyevent KEYCODE_POWER")
+    adb("adb shell input keyevent KEYCODE_POWER", idempotent=False)
 
 def device_wakeup():
     """Issue an ADB wakeup command."""
@@ -113,3 +184,153 @@ def pending_video_file_exists(dirname):
     files = ls(dirname, also_hidden=True, print_cmd=False)
     return any(f.startswith(".pending") for f in files)
 
+
+def free_space_bytes(path, print_cmd=True):
+    """Return the free space in bytes on the device volume holding `path`, as
+    reported by `df`."""
+    df_output, stderr = adb(f"adb shell df -k {path}", print_cmd=print_cmd)
+    df_lines = df_output.splitlines()
+    # Join the data lines in case a long filesystem name wrapped onto its own line.
+    fields = " ".join(df_lines[1:]).split()
+    return int(fields[3]) * 1024
+
+def remote_file_size(pathname, print_cmd=True):
+    """Return the size in bytes of the file at `pathname` on the device."""
+    stdout, stderr = adb(f"adb shell stat -c %s {pathname}", print_cmd=print_cmd)
+    return int(stdout.strip())
+
+def remote_file_mtime_ns(pathname, print_cmd=False):
+    """Return the mtime in nanoseconds, by the device clock, of the file at
+    `pathname` on the device, or `None` if it cannot be read."""
+    try:
+        stdout, stderr = adb(f"adb shell date -r {pathname} +%s%N", print_cmd=print_cmd)
+    except AdbError as e:
+        print(f"\nWARNING: Could not read the mtime of '{pathname}':\n   {e}",
+              file=sys.stderr)
+        return None
+    stdout = stdout.strip()
+    if not stdout.isdigit(): # Old toolbox `date` has no `-r` or prints a literal "%N".
+        return None
+    return int(stdout)
+
+def retry_transfer(transfer_fun, pathname):
+    """Run `transfer_fun(pathname)`, retrying it from the start with backoff if it
+    raises `AdbError`.  Returns what `transfer_fun` returns."""
+    for attempt in range(ADB_RETRIES + 1):
+        try:
+            return transfer_fun(pathname)
+        except AdbError as e:
+            if attempt == ADB_RETRIES:
+                raise
+            delay = ADB_RETRY_BACKOFF * 2**attempt
+            print(f"\nWARNING: {e}\nRetrying in {delay:g} s.", file=sys.stderr)
+            sleep(delay)
+            unreached = any(s in str(e) for s in ADB_UNREACHED_ERROR_STRINGS)
+            recover_adb_connection(reconnect=unreached)
+
+def start_stall_watchdog(proc, progress_fun):
+    """Start a thread which kills the transfer process `proc` (started in a new
+    session, so its process group can be killed) if the value returned by
+    `progress_fun`, such as the bytes received, stays the same for
+    `ADB_TRANSFER_STALL_TIMEOUT` seconds.  Returns an event which is set if the
+    process was killed."""
+    stalled = threading.Event()
+    def watch():
+        last_progress, last_change = progress_fun(), monotonic()
+        while proc.poll() is None:
+            sleep(1)
+            progress = progress_fun()
+            if progress != last_progress:
+                last_progress, last_change = progress, monotonic()
+            elif monotonic() - last_change > ADB_TRANSFER_STALL_TIMEOUT:
+                stalled.set()
+                os.killpg(proc.pid, signal.SIGKILL) # Any children may hold the pipes.
+                return
+    watchdog = threading.Thread(target=watch)
+    watchdog.daemon = True
+    watchdog.start()
+    return stalled
+
+def stream_pull_file(pathname):
+    """Pull the file at `pathname` to the CWD by streaming it through `adb exec-out
+    cat`.  The local file is preallocated to the remote size and written in large
+    blocks, and the SHA-256 checksum is computed from the same byte stream, so the
+    file is never re-read from disk to hash it.  A failed or stalled transfer is
+    retried from the start.  Returns the local path and the hex digest of the
+    checksum."""
+    return retry_transfer(stream_pull_file_once, pathname)
+
+def stream_pull_file_once(pathname):
+    """Make one attempt at the transfer for `stream_pull_file`."""
+    local_path = os.path.basename(pathname)
+    remote_size = remote_file_size(pathname, print_cmd=False)
+    cmd = ["adb", "exec-out", "cat", pathname]
+    print("\nADB: " + " ".join(cmd))
+
+    checksum = hashlib.sha256()
+    num_bytes = 0
+    with open(local_path, "wb", buffering=STREAM_PULL_BLOCK_SIZE) as f:
+        if hasattr(os, "posix_fallocate") and remote_size: # Avoid fragmenting big files.
+            os.posix_fallocate(f.fileno(), 0, remote_size)
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                bufsize=STREAM_PULL_BLOCK_SIZE, start_new_session=True)
+        stalled = start_stall_watchdog(proc, lambda: num_bytes)
+        while True:
+            block = proc.stdout.read(STREAM_PULL_BLOCK_SIZE)
+            if not block:
+                break
+            f.write(block)
+            checksum.update(block)
+            num_bytes += len(block)
+        f.truncate(num_bytes) # In case fewer bytes arrived than were preallocated.
+        stderr = proc.stderr.read().decode("utf-8", errors="replace")
+        returncode = proc.wait()
+
+    if stalled.is_set():
+        raise AdbError(f"Streaming pull of '{pathname}' stalled, received {num_bytes} of"
+                       f" {remote_size} bytes with no progress for"
+                       f" {ADB_TRANSFER_STALL_TIMEOUT} s.")
+    if returncode != 0 or num_bytes != remote_size:
+        raise AdbError(f"Streaming pull of '{pathname}' failed, received {num_bytes} of"
+                       f" {remote_size} bytes with exit status '{returncode}'.\n{stderr}")
+    return local_path, checksum.hexdigest()
+
+def delete_file(pathname, settle=True):
+    """Delete the file at `pathname` on the device and tell the media scanner,
+    after a short settling sleep if `settle` is true."""
+    adb(f"adb shell rm {pathname}")
+    if settle:
+        sleep(1)
+    adb(f"adb -d shell am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file:{pathname}")
+
+def pull_file_once(pathname):
+    """Make one attempt to pull the file at `pathname` to the CWD with `adb pull`,
+    killing it if the local file stops growing."""
+    local_path = os.path.basename(pathname)
+    cmd = ["adb", "pull", pathname]
+    print("\nADB: " + " ".join(cmd))
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            encoding="utf-8", start_new_session=True)
+    stalled = start_stall_watchdog(proc, lambda: os.path.getsize(local_path)
+                                                 if os.path.exists(local_path) else 0)
+    stdout, stderr = proc.communicate()
+    if stalled.is_set():
+        raise AdbError(f"ADB pull of '{pathname}' stalled, with no progress for"
+                       f" {ADB_TRANSFER_STALL_TIMEOUT} s.")
+    if proc.returncode != 0:
+        raise AdbError(f"ADB command '{' '.join(cmd)}' returned nonzero exit status"
+                       f" '{proc.returncode}'.\nThe command's output follows:\n{stdout}\n{stderr}")
+    return local_path
+
+def pull_and_delete_file(pathname, settle=True):
+    """Pull the file at the pathname and delete the remote file.  Returns the
+    path of the extracted video.  The settling sleeps before deleting are skipped
+    if `settle` is false, when the caller knows the file was closed."""
+    # Pull.
+    retry_transfer(pull_file_once, pathname) # Big files take a while, so no time limit.
+
+    # Delete.
+    if settle:
+        sleep(4)
+    delete_file(pathname, settle=settle)
+    return os.path.basename(pathname)
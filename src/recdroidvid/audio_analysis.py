@@ -0,0 +1,217 @@
+"""
+
+Loudness and peak analysis of the extracted audio files, for quickly finding
+the clipped or silent takes without auditioning every one.
+
+The WAV data is memory-mapped and processed in fixed-size chunks with NumPy,
+so memory use per file stays roughly constant however long the take is.  The
+loudness is an approximation of integrated loudness: it uses the BS.1770
+gating on 400 ms blocks but without the K-weighting filter.
+
+"""
+
+import sys
+import os
+import struct
+import concurrent.futures
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .settings_and_options import (ANALYSIS_CHUNK_SECONDS, ANALYSIS_CLIP_LEVEL,
+                ANALYSIS_SILENCE_PEAK_DBFS, ANALYSIS_ENVELOPE_POINTS, ANALYSIS_WORKERS)
+
+LOUDNESS_BLOCK_SECONDS = 0.4 # The BS.1770 gating block length.
+SPARKLINE_CHARS = " ▁▂▃▄▅▆▇█"
+
+def read_wav_layout(wav_path):
+    """Return a dict with the sample format, channels, rate, and the offset and
+    size of the data chunk in a WAV (or RF64) file."""
+    with open(wav_path, "rb") as f:
+        riff_header = f.read(12)
+        if len(riff_header) < 12:
+            raise ValueError(f"Truncated WAV file: '{wav_path}'")
+        riff_id, riff_size, wave_id = struct.unpack("<4sI4s", riff_header)
+        if riff_id not in (b"RIFF", b"RF64") or wave_id != b"WAVE":
+            raise ValueError(f"Not a WAV file: '{wav_path}'")
+        layout = {}
+        rf64_data_size = None
+        while True:
+            chunk_header = f.read(8)
+            if len(chunk_header) < 8:
+                break
+            chunk_id, chunk_size = struct.unpack("<4sI", chunk_header)
+            chunk_start = f.tell()
+            if chunk_id == b"ds64":
+                riff64_size, rf64_data_size = struct.unpack("<QQ", f.read(16))
+            elif chunk_id == b"fmt ":
+                fmt_chunk = f.read(chunk_size)
+                format_tag, channels, rate, byte_rate, block_align, bits = struct.unpack(
+                                                                  "<HHIIHH", fmt_chunk[:16])
+                if format_tag == 0xFFFE: # WAVE_FORMAT_EXTENSIBLE, tag starts the subformat.
+                    format_tag = struct.unpack("<H", fmt_chunk[24:26])[0]
+                layout.update({"format_tag": format_tag, "channels": channels,
+                               "rate": rate, "bits": bits})
+            elif chunk_id == b"data":
+                if riff_id == b"RF64" and chunk_size == 0xFFFFFFFF:
+                    chunk_size = rf64_data_size
+                layout.update({"data_offset": chunk_start, "data_size": chunk_size})
+                break
+            f.seek(chunk_start + chunk_size + (chunk_size % 2)) # Chunks are word-aligned.
+    if "format_tag" not in layout or "data_offset" not in layout:
+        raise ValueError(f"Missing fmt or data chunk in WAV file: '{wav_path}'")
+    return layout
+
+def memmap_wav_data(wav_path, layout):
+    """Memory-map the sample data, returning the array and a function which
+    converts a slice of it to float32 samples in the range [-1, 1]."""
+    channels, bits = layout["channels"], layout["bits"]
+    bytes_per_sample = bits // 8
+    num_frames = min(layout["data_size"],
+                     os.path.getsize(wav_path) - layout["data_offset"]) // (
+                                                              channels * bytes_per_sample)
+    if layout["format_tag"] == 3: # IEEE float.
+        dtype = {32: "<f4", 64: "<f8"}[bits]
+        to_float = lambda a: a.astype(np.float32)
+    elif bits == 24: # No native 24-bit type, so assemble from bytes.
+        dtype = "u1"
+        def to_float(a):
+            a = a.astype(np.int32)
+            ints = a[..., 0] | (a[..., 1] << 8) | (a[..., 2] << 16)
+            ints = np.where(ints >= 1 << 23, ints - (1 << 24), ints)
+            return ints.astype(np.float32) / (1 << 23)
+    elif bits == 8: # Unsigned 8-bit.
+        dtype = "u1"
+        to_float = lambda a: (a.astype(np.float32) - 128) / 128
+    else:
+        dtype = {16: "<i2", 32: "<i4"}[bits]
+        scale = float(1 << (bits - 1))
+        to_float = lambda a: a.astype(np.float32) / scale
+
+    shape = (num_frames, channels, 3) if bits == 24 else (num_frames, channels)
+    if num_frames == 0:
+        return np.zeros(shape, dtype=dtype), to_float
+    data = np.memmap(wav_path, dtype=dtype, mode="r", offset=layout["data_offset"],
+                     shape=shape)
+    return data, to_float
+
+def to_dbfs(value):
+    """Convert a linear amplitude to dBFS."""
+    return 20 * np.log10(value) if value > 0 else float("-inf")
+
+def analyze_audio_file(wav_path):
+    """Compute the peak, RMS, clipping count, approximate integrated loudness and a
+    downsampled peak envelope of the WAV file at `wav_path`.  Returns a dict."""
+    layout = read_wav_layout(wav_path)
+    data, to_float = memmap_wav_data(wav_path, layout)
+    rate = layout["rate"]
+    block_frames = max(1, int(LOUDNESS_BLOCK_SECONDS * rate))
+    # Keep the chunks a multiple of the block length so blocks never straddle chunks.
+    chunk_frames = block_frames * max(1, int(ANALYSIS_CHUNK_SECONDS / LOUDNESS_BLOCK_SECONDS))
+
+    peak = 0.0
+    sum_squares = 0.0
+    clipped_samples = 0
+    block_powers = []
+    block_peaks = []
+    for start in range(0, len(data), chunk_frames):
+        chunk = to_float(data[start:start+chunk_frames]) # Shape (frames, channels).
+        abs_chunk = np.abs(chunk)
+        peak = max(peak, float(abs_chunk.max()))
+        squares = chunk * chunk
+        sum_squares += float(squares.sum(dtype=np.float64))
+        clipped_samples += int(np.count_nonzero(abs_chunk >= ANALYSIS_CLIP_LEVEL))
+
+        num_blocks = len(chunk) // block_frames
+        if num_blocks:
+            used = num_blocks * block_frames
+            blocks = squares[:used].reshape(num_blocks, block_frames, -1)
+            block_powers.append(blocks.mean(axis=1, dtype=np.float64).sum(axis=1))
+            block_peaks.append(abs_chunk[:used].reshape(num_blocks, -1).max(axis=1))
+
+    num_samples = len(data) * layout["channels"]
+    rms = np.sqrt(sum_squares / num_samples) if num_samples else 0.0
+    block_powers = np.concatenate(block_powers) if block_powers else np.zeros(0)
+    block_peaks = np.concatenate(block_peaks) if block_peaks else np.zeros(0)
+
+    # Integrated loudness with the BS.1770 absolute (-70) and relative (-10 LU) gates.
+    loudness = float("-inf")
+    gated = block_powers[block_powers > 10 ** ((-70 + 0.691) / 10)]
+    if len(gated):
+        relative_gate = np.mean(gated) * 10 ** (-10 / 10)
+        gated = gated[gated > relative_gate]
+        loudness = -0.691 + 10 * np.log10(np.mean(gated))
+
+    # Downsample the block peaks to the envelope by taking the max of each group.
+    envelope = []
+    if len(block_peaks):
+        groups = np.array_split(block_peaks, min(ANALYSIS_ENVELOPE_POINTS, len(block_peaks)))
+        envelope = [float(g.max()) for g in groups]
+
+    return {"audio_path": wav_path,
+            "duration": len(data) / rate,
+            "peak_dbfs": float(to_dbfs(peak)),
+            "rms_dbfs": float(to_dbfs(rms)),
+            "clipped_samples": clipped_samples,
+            "loudness_lufs": float(loudness),
+            "envelope": envelope}
+
+def take_status(analysis):
+    """Return "CLIPPED", "SILENT" or "ok" for an analysis result."""
+    if analysis["clipped_samples"]:
+        return "CLIPPED"
+    if analysis["peak_dbfs"] < ANALYSIS_SILENCE_PEAK_DBFS:
+        return "SILENT"
+    return "ok"
+
+def sparkline(envelope, width=30):
+    """Return a text sparkline of a peak envelope, on a dB scale from -60 to 0."""
+    if not envelope:
+        return ""
+    groups = np.array_split(np.array(envelope), min(width, len(envelope)))
+    line = ""
+    for g in groups:
+        level = (max(float(to_dbfs(g.max())), -60) + 60) / 60
+        line += SPARKLINE_CHARS[round(level * (len(SPARKLINE_CHARS) - 1))]
+    return line
+
+def print_analysis_table(analyses):
+    """Print the analysis results ranked with the clipped takes first (most
+    clipping first), then the silent ones, then the rest loudest first."""
+    status_order = {"CLIPPED": 0, "SILENT": 1, "ok": 2}
+    ranked = sorted(analyses, key=lambda a: (status_order[take_status(a)],
+                                             -a["clipped_samples"], -a["loudness_lufs"]))
+    print(f"\n{'='*12} Audio analysis summary {'='*42}\n")
+    print(f"{'status':8} {'peak dB':>8} {'RMS dB':>7} {'~LUFS':>6} {'clips':>7} "
+          f"{'dur s':>7}  {'envelope':30}  file")
+    for a in ranked:
+        print(f"{take_status(a):8} {a['peak_dbfs']:8.1f} {a['rms_dbfs']:7.1f}"
+              f" {a['loudness_lufs']:6.1f} {a['clipped_samples']:7d} {a['duration']:7.1f}"
+              f"  {sparkline(a['envelope']):30}  {os.path.basename(a['audio_path'])}")
+
+def analyze_audio_files(audio_paths):
+    """Analyze the audio files in a process pool and print the ranked summary
+    table.  Returns a dict of the results keyed by audio path."""
+    if np is None:
+        print("\nWARNING: The numpy package is required for audio analysis; install it with"
+              " `pip install numpy`.  Skipping the analysis.", file=sys.stderr)
+        return {}
+    audio_paths = [p for p in audio_paths if os.path.isfile(p)]
+    if not audio_paths:
+        return {}
+
+    print(f"\nAnalyzing {len(audio_paths)} audio file(s)...")
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=ANALYSIS_WORKERS) as executor:
+        futures = {executor.submit(analyze_audio_file, p): p for p in audio_paths}
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                results[futures[future]] = future.result()
+            except (ValueError, KeyError, OSError, struct.error) as e:
+                print(f"\nWARNING: Could not analyze audio file '{futures[future]}':\n   {e}",
+                      file=sys.stderr)
+    if results:
+        print_analysis_table(list(results.values()))
+    return results
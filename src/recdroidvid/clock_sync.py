@@ -0,0 +1,87 @@
+"""
+
+Estimate the offset between the device clock and the host clock, so that times
+on the device (such as video file mtimes) can be mapped to host time with error
+bounds.
+
+The method is NTP-style: the device time is sampled with `adb shell date` and
+bracketed by host timestamps taken just before and after.  The device reading
+happened somewhere inside that round trip, so each sample gives the offset to
+within half its round-trip time.  Only the samples with the smallest round
+trips are used.
+
+"""
+
+import sys
+import time
+import datetime
+import statistics
+
+from .settings_and_options import CLOCK_SYNC_SAMPLES, CLOCK_SYNC_BEST_FRACTION
+from . import adb_commands as adb
+
+clock_sync_estimate = None # The most recent estimate, a dict from `estimate_clock_offset`.
+
+def sample_device_clock():
+    """Return a tuple `(host_before_ns, device_ns, host_after_ns)` for one sample
+    of the device clock, or `None` if the device `date` does not give nanoseconds."""
+    host_before_ns = time.time_ns()
+    stdout, stderr = adb.adb("adb shell date +%s%N", print_cmd=False)
+    host_after_ns = time.time_ns()
+    stdout = stdout.strip()
+    if not stdout.isdigit(): # Old toolbox `date` prints a literal "%N".
+        return None
+    return host_before_ns, int(stdout), host_after_ns
+
+def estimate_clock_offset(num_samples=CLOCK_SYNC_SAMPLES):
+    """Estimate the device-to-host clock offset from repeated samples.  Returns a
+    dict with the offset (device time minus host time), the error bound on it, the
+    minimum round-trip time and the jitter of the offsets used, all in nanoseconds.
+    The estimate is also saved as the module variable `clock_sync_estimate`.
+    Returns `None` if the device clock cannot be sampled."""
+    global clock_sync_estimate
+    print(f"\nEstimating the device clock offset from {num_samples} samples...")
+    samples = []
+    for i in range(num_samples):
+        sample = sample_device_clock()
+        if sample is None:
+            print("\nWARNING: The device `date` command does not support nanoseconds,"
+                  " cannot estimate the clock offset.", file=sys.stderr)
+            return None
+        host_before_ns, device_ns, host_after_ns = sample
+        rtt_ns = host_after_ns - host_before_ns
+        offset_ns = device_ns - (host_before_ns + host_after_ns) // 2
+        samples.append((rtt_ns, offset_ns))
+
+    # Keep the samples with the smallest round trips; they are the least delayed.
+    samples.sort()
+    best = samples[:max(1, int(len(samples) * CLOCK_SYNC_BEST_FRACTION))]
+    best_offsets = [offset for rtt, offset in best]
+    clock_sync_estimate = {
+        "offset_ns": int(statistics.median(best_offsets)),
+        # Each offset is within rtt/2 of the truth, so their median is within the max.
+        "error_ns": best[-1][0] // 2,
+        "min_rtt_ns": best[0][0],
+        "jitter_ns": int(statistics.pstdev(best_offsets)),
+        "num_samples": len(samples),
+        }
+    print(f"Device clock offset: {format_ns(clock_sync_estimate['offset_ns'])}"
+          f" ± {format_ns(clock_sync_estimate['error_ns'])}"
+          f" (min round trip {format_ns(clock_sync_estimate['min_rtt_ns'])},"
+          f" jitter {format_ns(clock_sync_estimate['jitter_ns'])})")
+    return clock_sync_estimate
+
+def device_to_host_ns(device_ns, estimate=None):
+    """Map a device time in nanoseconds to host time, returning the tuple
+    `(host_ns, error_ns)`."""
+    estimate = estimate or clock_sync_estimate
+    return device_ns - estimate["offset_ns"], estimate["error_ns"]
+
+def format_ns(ns):
+    """Format a duration in nanoseconds as milliseconds."""
+    return f"{ns/1e6:.1f} ms"
+
+def format_host_time(host_ns):
+    """Format a host time in nanoseconds as a local date and time, to the ms."""
+    date_time = datetime.datetime.fromtimestamp(host_ns / 1e9)
+    return date_time.strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
@@ -0,0 +1,84 @@
+"""
+
+Build contact sheets (a grid of evenly spaced frames in one image) for pulled
+videos.  Each sheet is made in a single ffmpeg pass which decodes only the
+keyframes, and the sheets are built in a small worker pool so they overlap
+the other processing stages.
+
+"""
+
+import sys
+import os
+import concurrent.futures
+
+from .settings_and_options import (CONTACT_SHEET_TILES, CONTACT_SHEET_FRAME_WIDTH,
+                CONTACT_SHEET_WORKERS, CONTACT_SHEET_SUFFIX)
+from .utility_functions import run_local_cmd_blocking, video_duration
+
+contact_sheet_executor = None # The worker pool, created when first needed.
+contact_sheet_futures = []
+
+def contact_sheet_path(video_path):
+    """Return the path of the contact sheet for the video at `video_path`."""
+    root_name, video_extension = os.path.splitext(video_path)
+    return root_name + CONTACT_SHEET_SUFFIX
+
+def contact_sheet_up_to_date(video_path, sheet_path):
+    """Return true if the sheet exists, is nonempty, and has the same mtime as the
+    video.  The sheet's mtime is set to the video's when it is built, so a changed
+    video or a partially-written sheet will be rebuilt."""
+    if not os.path.isfile(sheet_path) or os.path.getsize(sheet_path) == 0:
+        return False
+    return os.stat(sheet_path).st_mtime_ns == os.stat(video_path).st_mtime_ns
+
+def build_contact_sheet(video_path):
+    """Build the contact sheet for the video at `video_path`, unless it is already
+    up to date.  Returns the path of the sheet, or `None` on failure."""
+    sheet_path = contact_sheet_path(video_path)
+    if contact_sheet_up_to_date(video_path, sheet_path):
+        return sheet_path
+
+    duration = video_duration(video_path)
+    if not duration:
+        print(f"\nWARNING: Could not get the duration of '{video_path}', no contact sheet.",
+              file=sys.stderr)
+        return None
+    cols, rows = (int(n) for n in CONTACT_SHEET_TILES.split("x"))
+    interval = duration / (cols * rows)
+
+    # Only keyframes are decoded; of those, select the first one in each time slot
+    # and tile them.
+    slot = f"{interval:.3f}"
+    video_filter = (f"select='isnan(prev_selected_t)"
+                    f"+gt(floor(t/{slot}),floor(prev_selected_t/{slot}))',"
+                    f"scale={CONTACT_SHEET_FRAME_WIDTH}:-2,tile={cols}x{rows}")
+    tmp_sheet_path = sheet_path + ".tmp.jpg" # Written then renamed, so never left partial.
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-skip_frame", "nokey", "-i", video_path,
+           "-an", "-vf", video_filter, "-vsync", "vfr", "-frames:v", "1", tmp_sheet_path]
+    returncode, stdout, stderr = run_local_cmd_blocking(cmd, fail_on_nonzero_exit=False)
+    if returncode != 0 or not os.path.isfile(tmp_sheet_path):
+        print(f"\nWARNING: Building the contact sheet for '{video_path}' failed:\n{stderr}",
+              file=sys.stderr)
+        return None
+
+    os.replace(tmp_sheet_path, sheet_path)
+    video_stat = os.stat(video_path)
+    os.utime(sheet_path, ns=(video_stat.st_atime_ns, video_stat.st_mtime_ns))
+    print(f"\nContact sheet saved: {sheet_path}")
+    return sheet_path
+
+def submit_contact_sheet(video_path):
+    """Queue a contact sheet to be built in the worker pool."""
+    global contact_sheet_executor
+    if contact_sheet_executor is None:
+        contact_sheet_executor = concurrent.futures.ThreadPoolExecutor(
+                                                    max_workers=CONTACT_SHEET_WORKERS)
+    contact_sheet_futures.append(contact_sheet_executor.submit(build_contact_sheet,
+                                                               video_path))
+
+def wait_for_contact_sheets():
+    """Wait for all the queued contact sheets to finish.  Returns the list of
+    sheet paths that were built or already up to date."""
+    sheet_paths = [f.result() for f in contact_sheet_futures]
+    contact_sheet_futures.clear()
+    return [p for p in sheet_paths if p]
@@ -0,0 +1,219 @@
+"""
+
+Daemon mode, where the device stays awake with the camera app open and takes
+are triggered by commands sent over a local Unix socket.
+
+Each connection sends one command as a line of text and gets back one line of
+JSON with an "ok" field.  The commands are:
+
+    start   Start recording (and the DAW transport, if syncing).
+    stop    Stop recording (and the DAW transport, if syncing).
+    mark    Add a mark in the DAW.
+    status  Return the cached daemon state without contacting the device.
+    pull    Pull, rename and process the videos recorded since the last pull.
+    quit    Shut down the daemon.
+
+For example, from a shell:
+
+    echo start | nc -U ~/.recdroidvid_daemon.sock
+
+"""
+
+import sys
+import os
+import json
+import time
+import socket
+import socketserver
+import threading
+import traceback
+from time import sleep
+
+from .settings_and_options import args, VIDEO_FILE_EXTENSION
+from . import adb_commands as adb
+from . import recdroidvid_main as rdv_main
+from . import clock_sync
+
+daemon_commands_lock = threading.Lock() # Only one command talks to the device at a time.
+
+daemon_state = {} # Cached state, returned by the "status" command.
+
+def daemon_reply(ok, **kwargs):
+    """Return a reply dict for a command, including a copy of the daemon state."""
+    reply = {"ok": ok}
+    reply.update(kwargs)
+    reply["state"] = dict(daemon_state)
+    return reply
+
+def camera_dir_video_files():
+    """Return the list of video files currently in the camera save directory."""
+    return adb.ls(args().camera_save_dir[0], extension_whitelist=[VIDEO_FILE_EXTENSION],
+                  print_cmd=False)
+
+def daemon_start_recording():
+    """Start recording on the device, and start the DAW transport if syncing."""
+    if daemon_state["recording"]:
+        return daemon_reply(False, error="Already recording.")
+    tap_ns = time.time_ns()
+    adb.tap_camera_button()
+    rdv_main.log_record_event("record_start", tap_ns)
+    if args().sync_daw_transport_with_video_recording:
+        rdv_main.start_daw_transport_for_recording()
+    daemon_state["recording"] = True
+    daemon_state["recording_started"] = time.time()
+    return daemon_reply(True)
+
+def daemon_stop_recording():
+    """Stop recording on the device, and stop the DAW transport if syncing."""
+    if not daemon_state["recording"]:
+        return daemon_reply(False, error="Not recording.")
+    tap_ns = time.time_ns()
+    adb.tap_camera_button()
+    rdv_main.log_record_event("record_stop", tap_ns)
+    if args().sync_daw_transport_with_video_recording:
+        rdv_main.stop_daw_transport_for_recording()
+    daemon_state["recording"] = False
+    daemon_state["recording_started"] = None
+    while adb.directory_size_increasing(args().camera_save_dir[0]):
+        print("Waiting for save directory to stop increasing in size...")
+        sleep(1)
+    return daemon_reply(True)
+
+def daemon_add_mark():
+    """Add a mark in the DAW."""
+    rdv_main.add_mark_in_daw()
+    return daemon_reply(True)
+
+def daemon_pull_videos():
+    """Pull and process the videos recorded since the daemon started.  Pulled videos
+    are deleted from the device, so the startup listing is kept as the baseline."""
+    if daemon_state["recording"]:
+        return daemon_reply(False, error="Cannot pull while recording.")
+    new_video_files = [f for f in camera_dir_video_files()
+                                      if f not in daemon_state["baseline_ls"]]
+    video_paths = [os.path.join(args().camera_save_dir[0], v) for v in new_video_files]
+    pulled_paths = rdv_main.pull_and_rename_videos(video_paths,
+                                                   daemon_state["next_video_number"])
+    # Update the state before processing, so numbering stays right if processing fails.
+    daemon_state["next_video_number"] += len(pulled_paths)
+    daemon_state["last_pulled"] = pulled_paths
+    daemon_state["num_pulled"] += len(pulled_paths)
+
+    rdv_main.process_pulled_videos(pulled_paths)
+    return daemon_reply(True, pulled=pulled_paths)
+
+def run_daemon_command(command, server):
+    """Run a daemon command and return the reply dict."""
+    if command == "status": # Only reads the cached state, so no lock is needed.
+        return daemon_reply(True)
+    if command == "quit":
+        # The `shutdown` method blocks until `serve_forever` returns, so use another thread.
+        threading.Thread(target=server.shutdown, daemon=True).start()
+        return daemon_reply(True)
+
+    command_functions = {"start": daemon_start_recording,
+                         "stop": daemon_stop_recording,
+                         "mark": daemon_add_mark,
+                         "pull": daemon_pull_videos}
+    if command not in command_functions:
+        return daemon_reply(False, error=f"Unrecognized command '{command}'.")
+
+    print(f"\nDaemon command: {command}")
+    with daemon_commands_lock:
+        daemon_state["last_command"] = command
+        try:
+            return command_functions[command]()
+        # Failed commands are reported to the client, but keep the daemon running.
+        except adb.AdbError as e:
+            print(f"\nERROR: {e}", file=sys.stderr)
+            return daemon_reply(False, error=f"Command '{command}' failed: {e}")
+        # Some local commands still call `sys.exit` on failure.  In this handler thread
+        # that would only end the thread, leaving the client with no reply.
+        except (SystemExit, Exception):
+            traceback.print_exc()
+            return daemon_reply(False, error=f"Command '{command}' failed, see daemon output.")
+
+class DaemonRequestHandler(socketserver.StreamRequestHandler):
+    """Handle a connection to the daemon socket, one command per connection."""
+    def handle(self):
+        command = self.rfile.readline().decode("utf-8").strip().lower()
+        reply = run_daemon_command(command, self.server)
+        self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+def daemon_socket_path():
+    """Return the expanded path to the daemon socket."""
+    return os.path.abspath(os.path.expanduser(args().daemon_socket[0]))
+
+def remove_stale_socket(socket_path):
+    """Remove a socket file left behind by a daemon that is no longer running.
+    Exits if a daemon is still listening on it."""
+    if not os.path.exists(socket_path):
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError:
+            os.remove(socket_path)
+            return
+    print(f"\nERROR: A recdroidvid daemon is already running on socket '{socket_path}'.",
+          file=sys.stderr)
+    sys.exit(1)
+
+def run_daemon(video_start_number):
+    """Set up the device, start the scrcpy monitor, and serve commands on the
+    daemon socket until the "quit" command is received."""
+    socket_path = daemon_socket_path()
+    remove_stale_socket(socket_path)
+
+    adb.device_wakeup()
+    adb.unlock_screen()
+    adb.open_video_camera()
+    if args().raise_daw_on_camera_app_open:
+        rdv_main.raise_daw_in_window_stack()
+    if args().clock_sync:
+        clock_sync.estimate_clock_offset()
+    rdv_main.start_screen_monitor_bg()
+
+    daemon_state.clear()
+    daemon_state.update({"recording": False,
+                         "recording_started": None,
+                         "next_video_number": video_start_number,
+                         "num_pulled": 0,
+                         "last_pulled": [],
+                         "last_command": None,
+                         "baseline_ls": camera_dir_video_files(),
+                         "started": time.time()})
+
+    server = socketserver.ThreadingUnixStreamServer(socket_path, DaemonRequestHandler)
+    server.daemon_threads = True
+    print(f"\nDaemon listening for commands on socket:\n   {socket_path}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(socket_path)
+
+    if daemon_state["recording"]:
+        daemon_stop_recording()
+    adb.device_sleep() # Put the device to sleep after use.
+
+def send_daemon_command(command):
+    """Send a command to the running daemon and print the reply.  Exits with a
+    nonzero status if the command failed."""
+    socket_path = daemon_socket_path()
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(socket_path)
+            sock.sendall((command + "\n").encode("utf-8"))
+            with sock.makefile("r", encoding="utf-8") as sock_file:
+                reply = sock_file.readline()
+    except OSError as e:
+        print(f"\nERROR: Could not send command to the recdroidvid daemon at"
+              f" '{socket_path}':\n   {e}", file=sys.stderr)
+        sys.exit(1)
+
+    print(reply.strip())
+    if not reply or not json.loads(reply)["ok"]:
+        sys.exit(1)
@@ -0,0 +1,122 @@
+"""
+
+Python hooks which the `.recdroidvid_rc.py` file can register, so events can be
+handled in-process instead of by spawning a shell command each time.  In the
+config file:
+
+    from recdroidvid import register_hook
+
+    def log_take(video_path, metadata):
+        print("Pulled", video_path, metadata.get("sha256"))
+
+    register_hook("on_file_pulled", log_take, background=True)
+
+The event hooks and the arguments they are called with:
+
+    on_record_start(event)       Recording start detected, `event` is a dict with
+    on_record_stop(event)        the event name and the host-time bounds in ns.
+    on_monitor_closed(event)
+    on_daw_start(event)          The DAW transport was started or stopped for
+    on_daw_stop(event)           recording.
+    on_file_pulled(video_path, metadata)   A video was pulled and renamed.
+    on_postprocess(video_path, metadata)   At the postprocessing stage of a video.
+    on_takes_processed(takes)    All the videos of a pull are processed, `takes`
+                                 is a dict of their metadata keyed by video path.
+
+The `metadata` is the take metadata dict (remote path, number, checksum, times,
+audio path, etc.).  Hooks registered with `background=True` run on a worker
+pool and get a copy of it; the others run in turn, in the order registered,
+and get the dict itself.
+
+The override hooks replace the DAW command options when registered, and always
+run synchronously.  They are called with no arguments:
+
+    toggle_daw_transport()       Instead of `--toggle-daw-transport-cmd`.
+    add_daw_mark()               Instead of `--add-daw-mark-cmd`.
+    raise_daw_to_top()           Instead of `--raise-daw-to-top-cmd`.
+    is_daw_running()             Instead of `--is-daw-running-cmd`, returns a bool.
+
+An exception raised by a hook is printed as a warning and does not stop the
+session.
+
+"""
+
+import sys
+import copy
+import threading
+import traceback
+import concurrent.futures
+
+from .settings_and_options import HOOK_WORKERS
+
+EVENT_HOOKS = ["on_record_start", "on_record_stop", "on_monitor_closed", "on_daw_start",
+               "on_daw_stop", "on_file_pulled", "on_postprocess", "on_takes_processed"]
+OVERRIDE_HOOKS = ["toggle_daw_transport", "add_daw_mark", "raise_daw_to_top",
+                  "is_daw_running"]
+
+registered_hooks = {} # Lists of `(func, background)` tuples keyed by the event name.
+hook_executor = None # The worker pool for background hooks, created when first needed.
+hook_futures = []
+hook_futures_lock = threading.Lock() # Hooks can be run from the DAW sync thread too.
+
+def register_hook(event, func, background=False):
+    """Register the callable `func` to be run for the hook `event`.  If `background`
+    is true it is run on a worker pool.  Returns `func`."""
+    if event not in EVENT_HOOKS + OVERRIDE_HOOKS:
+        raise ValueError(f"Unknown recdroidvid hook event '{event}', the events are:"
+                         f" {', '.join(EVENT_HOOKS + OVERRIDE_HOOKS)}.")
+    if background and event in OVERRIDE_HOOKS:
+        raise ValueError(f"The override hook '{event}' cannot run in the background.")
+    registered_hooks.setdefault(event, []).append((func, background))
+    return func
+
+def has_hooks(event):
+    """Return true if any hooks are registered for `event`."""
+    return bool(registered_hooks.get(event))
+
+def print_hook_exception(event, func):
+    """Print a warning with the traceback of the exception raised by a hook."""
+    print(f"\nWARNING: The '{event}' hook {getattr(func, '__name__', func)} raised an"
+          f" exception:\n{traceback.format_exc()}", file=sys.stderr)
+
+def run_background_hook(event, func, *args):
+    """Run a hook on the worker pool, printing a warning if it raises an exception."""
+    try:
+        func(*args)
+    except Exception:
+        print_hook_exception(event, func)
+
+def run_hooks(event, *args):
+    """Run the hooks registered for `event` with the arguments `args`."""
+    global hook_executor
+    for func, background in registered_hooks.get(event, []):
+        if background:
+            with hook_futures_lock:
+                if hook_executor is None:
+                    hook_executor = concurrent.futures.ThreadPoolExecutor(
+                                                            max_workers=HOOK_WORKERS)
+                hook_futures[:] = [f for f in hook_futures if not f.done()]
+                hook_futures.append(hook_executor.submit(run_background_hook, event, func,
+                                                         *copy.deepcopy(args)))
+            continue
+        try:
+            func(*args)
+        except Exception:
+            print_hook_exception(event, func)
+
+def run_override_hook(event):
+    """Run the most recently registered hook for the override hook `event` and
+    return its value, or `None` if it raises an exception."""
+    func, background = registered_hooks[event][-1]
+    try:
+        return func()
+    except Exception:
+        print_hook_exception(event, func)
+        return None
+
+def wait_for_hooks():
+    """Wait for all the queued background hooks to finish."""
+    with hook_futures_lock:
+        futures = list(hook_futures)
+        hook_futures.clear()
+    concurrent.futures.wait(futures)
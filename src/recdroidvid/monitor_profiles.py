@@ -0,0 +1,142 @@
+"""
+
+Run the scrcpy monitor with an adaptive profile.  The host CPU load (and the
+Jack xrun count, if a command to get it is set) are sampled while scrcpy runs,
+and when the load stays too high scrcpy is restarted with the next lighter
+profile from `SCRCPY_MONITOR_PROFILES`.  Only the monitor display changes;
+recording on the device is not affected by the restart.
+
+Linux only, since the CPU loads are read from `/proc`.
+
+"""
+
+import sys
+import os
+import re
+import subprocess
+from time import sleep, monotonic
+
+from .settings_and_options import (SCRCPY_MONITOR_PROFILES, MONITOR_PROFILE_CPU_THRESHOLD,
+                MONITOR_PROFILE_SAMPLE_TIME, MONITOR_PROFILE_OVERLOAD_SAMPLES,
+                JACK_XRUN_COUNT_CMD)
+from .utility_functions import run_local_cmd_blocking
+
+def read_host_cpu_times():
+    """Return the tuple `(busy, total)` of cumulative host CPU jiffies from `/proc/stat`."""
+    with open("/proc/stat", "r", encoding="utf-8") as f:
+        fields = [int(n) for n in f.readline().split()[1:]]
+    idle = fields[3] + fields[4] # The idle and iowait times.
+    total = sum(fields[:8]) # Guest times are already counted in user and nice.
+    return total - idle, total
+
+def read_process_cpu_jiffies(pid):
+    """Return the cumulative user plus system CPU jiffies of process `pid`, or
+    `None` if the process is gone."""
+    try:
+        with open(f"/proc/{pid}/stat", "r", encoding="utf-8") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    fields = stat[stat.rfind(")")+2:].split() # The command name may contain spaces.
+    return int(fields[11]) + int(fields[12])
+
+def read_jack_xrun_count():
+    """Return the cumulative Jack xrun count from the `JACK_XRUN_COUNT_CMD` command
+    (the last integer in its output), or `None` if it is not set or fails."""
+    if not JACK_XRUN_COUNT_CMD:
+        return None
+    returncode, stdout, stderr = run_local_cmd_blocking(JACK_XRUN_COUNT_CMD,
+                                                        fail_on_nonzero_exit=False)
+    numbers = re.findall(r"\d+", stdout)
+    if returncode != 0 or not numbers:
+        return None
+    return int(numbers[-1])
+
+def apply_monitor_profile(scrcpy_cmd, profile_args):
+    """Return the scrcpy command string with the options set by any profile removed
+    and the options of `profile_args` appended."""
+    profile_option_names = {a.split("=")[0] for name, options in SCRCPY_MONITOR_PROFILES
+                                            for a in options}
+    for option_name in profile_option_names:
+        scrcpy_cmd = re.sub(rf"\s{re.escape(option_name)}(=\S+)?(?=\s|$)", "", scrcpy_cmd)
+    return scrcpy_cmd + " " + " ".join(profile_args)
+
+def print_monitor_profile_log(profile_log):
+    """Print which monitor profiles were used, for how long, and the CPU they cost."""
+    print("\nscrcpy monitor profile log:")
+    for entry in profile_log:
+        num = max(1, len(entry["host_cpu"]))
+        print(f"   {entry['profile']:10} {entry['seconds']:8.1f} s, host CPU"
+              f" {sum(entry['host_cpu'])/num:5.1f}%, scrcpy CPU"
+              f" {sum(entry['scrcpy_cpu'])/num:5.1f}% of one core,"
+              f" {entry['xruns']} xruns")
+
+def run_adaptive_screen_monitor(scrcpy_cmd):
+    """Run scrcpy with the first monitor profile, restarting it with lighter ones
+    while the host load is too high.  Blocks until the user closes scrcpy."""
+    if not os.path.isfile("/proc/stat"):
+        print("\nWARNING: Cannot read host CPU loads, not adapting the monitor profile.",
+              file=sys.stderr)
+        run_local_cmd_blocking(scrcpy_cmd, print_cmd=True, print_cmd_prefix="SYSTEM: ",
+                               capture_output=False)
+        return
+
+    clock_ticks = os.sysconf("SC_CLK_TCK")
+    profile_log = []
+    profile_index = 0
+    while True:
+        profile_name, profile_args = SCRCPY_MONITOR_PROFILES[profile_index]
+        cmd = apply_monitor_profile(scrcpy_cmd, profile_args)
+        print(f"\nSYSTEM (monitor profile '{profile_name}'): {cmd}")
+        # The exec makes the shell's pid the scrcpy pid, for reading its CPU use.
+        proc = subprocess.Popen("exec " + cmd, shell=True)
+
+        entry = {"profile": profile_name, "seconds": 0.0, "host_cpu": [], "scrcpy_cpu": [],
+                 "xruns": 0}
+        profile_log.append(entry)
+        start_time = monotonic()
+        prev_host_busy, prev_host_total = read_host_cpu_times()
+        prev_scrcpy_jiffies = read_process_cpu_jiffies(proc.pid) or 0
+        prev_xruns = read_jack_xrun_count()
+        prev_time = start_time
+        overloaded_samples = 0
+        restart = False
+
+        while proc.poll() is None:
+            sleep(MONITOR_PROFILE_SAMPLE_TIME)
+            now = monotonic()
+            host_busy, host_total = read_host_cpu_times()
+            scrcpy_jiffies = read_process_cpu_jiffies(proc.pid)
+            if scrcpy_jiffies is None: # Exited during the sleep.
+                break
+            host_cpu = 100 * (host_busy - prev_host_busy) / max(1, host_total - prev_host_total)
+            scrcpy_cpu = 100 * (scrcpy_jiffies - prev_scrcpy_jiffies) / clock_ticks / (
+                                                                          now - prev_time)
+            entry["host_cpu"].append(host_cpu)
+            entry["scrcpy_cpu"].append(scrcpy_cpu)
+            xruns = read_jack_xrun_count()
+            new_xruns = xruns - prev_xruns if xruns is not None and prev_xruns is not None else 0
+            entry["xruns"] += max(0, new_xruns)
+            prev_host_busy, prev_host_total = host_busy, host_total
+            prev_scrcpy_jiffies, prev_xruns, prev_time = scrcpy_jiffies, xruns, now
+
+            if host_cpu > MONITOR_PROFILE_CPU_THRESHOLD or new_xruns > 0:
+                overloaded_samples += 1
+            else:
+                overloaded_samples = 0
+            if (overloaded_samples >= MONITOR_PROFILE_OVERLOAD_SAMPLES
+                    and profile_index < len(SCRCPY_MONITOR_PROFILES) - 1):
+                print(f"\nHost overloaded (CPU {host_cpu:.0f}%, {new_xruns} new xruns),"
+                      f" restarting scrcpy with a lighter monitor profile.")
+                proc.terminate()
+                proc.wait()
+                profile_index += 1
+                restart = True
+                break
+
+        entry["seconds"] = monotonic() - start_time
+        if not restart:
+            proc.wait()
+            break
+
+    print_monitor_profile_log(profile_log)
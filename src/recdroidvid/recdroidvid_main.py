@@ -26,15 +26,30 @@ from time import sleep
 import subprocess
 import datetime
 import threading
+import queue
+import time
+import shlex
 
 from .settings_and_options import (parse_command_line, args, DETECT_JACK_CMD,
                 USE_SCREENRECORD, RECORD_DETECTION_METHOD, SYNC_DAW_SLEEP_TIME,
                 VIDEO_FILE_EXTENSION, QUERY_EXTRACT_AUDIO, QUERY_PREVIEW_VIDEO,
                 EXTRACTED_AUDIO_EXTENSION, POSTPROCESS_VIDEOS,
-                POSTPROCESSING_CMD)
+                POSTPROCESSING_CMD, CONTINUOUS_POLL_TIME, CONTINUOUS_PULL_SETTLE_TIMEOUT,
+                DAW_CMD_TIMEOUT)
 
-from .utility_functions import query_yes_no, indent_lines, run_local_cmd_blocking
+from .utility_functions import (query_yes_no, indent_lines, run_local_cmd_blocking,
+                                video_duration, ffprobe_metadata, file_sha256)
 from . import adb_commands as adb
+from . import storage_monitor
+from . import audio_analysis
+from . import contact_sheets
+from . import clock_sync
+from . import monitor_profiles
+from . import take_catalog
+from . import segment_join
+from . import hooks
+from . import scheduled_start
+from . import take_trim
 
 #
 # Local machine startup functions.
@@ -48,7 +63,8 @@ def print_startup_message():
 
 def detect_if_jack_running():
     """Determine if the Jack audio system is currently running; return true if it is."""
-    errorcode, stdout, stderr = run_local_cmd_blocking(DETECT_JACK_CMD, fail_on_nonzero_exit=False)
+    errorcode, stdout, stderr = run_local_cmd_blocking(DETECT_JACK_CMD, fail_on_nonzero_exit=False,
+                                                       timeout=DAW_CMD_TIMEOUT)
     if errorcode == 0:
         return True
     return False
@@ -68,18 +84,26 @@ def detect_if_jack_running():
 
 def raise_daw_in_window_stack():
     """Run the command to raise the DAW in the window stack."""
+    if hooks.has_hooks("raise_daw_to_top"):
+        print("\nRaising DAW to top of Window stack with the raise_daw_to_top hook.")
+        hooks.run_override_hook("raise_daw_to_top")
+        return 0
     print("\nRaising DAW to top of Window stack:", args().raise_daw_to_top_cmd[0])
     # Allow the command to fail, but issue a warning.
     returncode, stdout, stderr = run_local_cmd_blocking(args().raise_daw_to_top_cmd[0],
-                                                        fail_on_nonzero_exit=False)
+                                                        fail_on_nonzero_exit=False,
+                                                        timeout=DAW_CMD_TIMEOUT)
     if returncode != 0:
         print("\nWARNING: Nonzero exit status running the raise-DAW command.", file=sys.stderr)
     return returncode
 
 def is_daw_running():
     """Return true or false as to whether the DAW is running."""
+    if hooks.has_hooks("is_daw_running"):
+        return bool(hooks.run_override_hook("is_daw_running"))
     returncode, stdout, stderr = run_local_cmd_blocking(args().is_daw_running_cmd[0],
-                                                               fail_on_nonzero_exit=False)
+                                                               fail_on_nonzero_exit=False,
+                                                               timeout=DAW_CMD_TIMEOUT)
     if returncode != 0:
         return False
     return True
@@ -90,11 +114,17 @@ def toggle_daw_transport():
         print("WARNING: DAW is not detected as running, not toggling transport.",
                 file=sys.stderr)
         return
-    print("\nToggle DAW transport cmd:", args().toggle_daw_transport_cmd[0])
-    returncode, stdout, stderr = run_local_cmd_blocking(args().toggle_daw_transport_cmd[0],
-                                                               fail_on_nonzero_exit=False)
-    if returncode !=0:
-        print("WARNING: Nonzero exit status running the toggle-daw command.", file=sys.stderr)
+    if hooks.has_hooks("toggle_daw_transport"):
+        print("\nToggle DAW transport with the toggle_daw_transport hook.")
+        hooks.run_override_hook("toggle_daw_transport")
+    else:
+        print("\nToggle DAW transport cmd:", args().toggle_daw_transport_cmd[0])
+        returncode, stdout, stderr = run_local_cmd_blocking(args().toggle_daw_transport_cmd[0],
+                                                            fail_on_nonzero_exit=False,
+                                                            timeout=DAW_CMD_TIMEOUT)
+        if returncode !=0:
+            print("WARNING: Nonzero exit status running the toggle-daw command.",
+                  file=sys.stderr)
     if args().raise_daw_on_transport_toggle:
         raise_returncode = raise_daw_in_window_stack()
 
@@ -103,11 +133,30 @@ def add_mark_in_daw():
     if not is_daw_running():
         print("WARNING: DAW is not detected as running, not adding a mark.", file=sys.stderr)
         return
+    if hooks.has_hooks("add_daw_mark"):
+        print("\nAdding a new mark in the DAW with the add_daw_mark hook.")
+        hooks.run_override_hook("add_daw_mark")
+        return
     print(f"\nAdding a new mark in the DAW: {args().add_daw_mark_cmd[0]}")
-    run_local_cmd_blocking(args().add_daw_mark_cmd[0])
+    returncode, stdout, stderr = run_local_cmd_blocking(args().add_daw_mark_cmd[0],
+                                                        fail_on_nonzero_exit=False,
+                                                        timeout=DAW_CMD_TIMEOUT)
+    if returncode != 0:
+        print("WARNING: Nonzero exit status running the add-DAW-mark command.", file=sys.stderr)
 
 sync_daw_stop_flag = False # Flag to signal the DAW sync thread to stop.
 
+record_events = [] # Detected recording events, as dicts with host-time bounds in ns.
+
+def log_record_event(event, earliest_ns, latest_ns=None):
+    """Save a recording event (such as "record_start" or "record_stop") which is
+    known to have happened between the host times `earliest_ns` and `latest_ns`."""
+    if latest_ns is None:
+        latest_ns = time.time_ns()
+    record_events.append({"event": event, "earliest_ns": earliest_ns,
+                          "latest_ns": latest_ns})
+    hooks.run_hooks("on_" + event, dict(record_events[-1]))
+
 def video_is_recording_on_device():
     """Function to detect when video is recording on the Android device, returns
     true or false."""
@@ -121,23 +170,68 @@ def video_is_recording_on_device():
           f"\n   '{RECORD_DETECTION_METHOD}'", file=sys.stderr)
     sys.exit(1)
 
+daw_transport_rolling = False # Whether the transport was started for recording.
+daw_transport_lock = threading.Lock() # The scheduled start and DAW sync threads share it.
+
+def start_daw_transport_for_recording():
+    """Start the DAW transport (adding a mark if selected) when video recording
+    starts, unless it was already started for this recording."""
+    global daw_transport_rolling
+    with daw_transport_lock:
+        if daw_transport_rolling:
+            return
+        print("\nStarting (toggling) DAW transport.")
+        if args().add_daw_mark_on_transport_start:
+            add_mark_in_daw()
+        toggle_ns = time.time_ns()
+        toggle_daw_transport() # Later could be a "start transport" cmd.
+        log_record_event("daw_start", toggle_ns)
+        daw_transport_rolling = True
+
+def stop_daw_transport_for_recording():
+    """Stop the DAW transport when video recording stops, if it was started for
+    the recording."""
+    global daw_transport_rolling
+    with daw_transport_lock:
+        if not daw_transport_rolling:
+            return
+        print("\nStopping (toggling) DAW transport.")
+        toggle_ns = time.time_ns()
+        toggle_daw_transport() # Later could be a "stop transport" cmd.
+        log_record_event("daw_stop", toggle_ns)
+        daw_transport_rolling = False
+
 def sync_daw_transport_bg_process(stop_flag_fun):
     """Start the DAW transport when video recording is detected on the Android
     device.  Meant to be run as a thread or via multiprocessing to execute at the
     same time as the scrcpy monitor."""
-    daw_transport_rolling = False
+    video_was_recording = False
+    prev_poll_ns = time.time_ns() # A change happened between the previous poll and this one.
     while True:
-        vid_recording = video_is_recording_on_device()
-        if not daw_transport_rolling and vid_recording: # Start DAW recording transport.
-            print("\nStarting (toggling) DAW transport.")
-            if args().add_daw_mark_on_transport_start:
-                add_mark_in_daw()
-            toggle_daw_transport() # Later could be a "start transport" cmd.
-            daw_transport_rolling = True
-        if daw_transport_rolling and not vid_recording: # Stop DAW recording transport.
-            print("\nStopping (toggling) DAW transport.")
-            toggle_daw_transport() # Later could be a "stop transport" cmd.
-            daw_transport_rolling = False
+        if not adb.feature_available("DAW sync"): # Paused after repeated ADB failures.
+            if stop_flag_fun():
+                break
+            sleep(SYNC_DAW_SLEEP_TIME)
+            continue
+        poll_ns = time.time_ns()
+        try:
+            vid_recording = video_is_recording_on_device()
+        except adb.AdbError as e:
+            adb.record_feature_failure("DAW sync", e)
+            if stop_flag_fun():
+                break
+            sleep(SYNC_DAW_SLEEP_TIME)
+            continue
+        adb.record_feature_success("DAW sync")
+        if not video_was_recording and vid_recording: # Start DAW recording transport.
+            log_record_event("record_start", prev_poll_ns)
+            start_daw_transport_for_recording()
+            video_was_recording = True
+        if video_was_recording and not vid_recording: # Stop DAW recording transport.
+            log_record_event("record_stop", prev_poll_ns)
+            stop_daw_transport_for_recording()
+            video_was_recording = False
+        prev_poll_ns = poll_ns
         if stop_flag_fun():
             break
         sleep(SYNC_DAW_SLEEP_TIME)
@@ -219,26 +313,78 @@ def start_screen_monitor():
     scrcpy_cmd = args().scrcpy_cmd[0]
 
     window_title_str = f"video file prefix: {args().video_file_prefix}"
-    run_local_cmd_blocking(scrcpy_cmd, print_cmd=True, print_cmd_prefix="SYSTEM: ",
-                           macro_dict={"RDV_SCRCPY_TITLE": window_title_str},
-                           capture_output=False)
+    if args().storage_monitor:
+        window_title_str += f", {storage_monitor.storage_status_string()}"
+    window_title_str = shlex.quote(window_title_str) # The scrcpy cmd is run by the shell.
+    for quote in ("'", '"'): # Drop quotes around the macro, since the title is quoted.
+        scrcpy_cmd = scrcpy_cmd.replace(f"{quote}RDV_SCRCPY_TITLE{quote}", "RDV_SCRCPY_TITLE")
+    adb.screen_monitor_running = True # Keeps ADB retries from reconnecting.
+    try:
+        if args().adaptive_monitor_profile:
+            scrcpy_cmd = scrcpy_cmd.replace("RDV_SCRCPY_TITLE", window_title_str)
+            monitor_profiles.run_adaptive_screen_monitor(scrcpy_cmd)
+            return
+        run_local_cmd_blocking(scrcpy_cmd, print_cmd=True, print_cmd_prefix="SYSTEM: ",
+                               macro_dict={"RDV_SCRCPY_TITLE": window_title_str},
+                               capture_output=False)
+    finally:
+        adb.screen_monitor_running = False
+
+def start_screen_monitor_bg():
+    """Run the scrcpy screen monitor in a background thread, returning the thread."""
+    proc = threading.Thread(target=start_screen_monitor)
+    proc.daemon = True # This is so the thread always dies when the main program exits.
+    proc.start()
+    return proc
+
+def start_scheduled_recording():
+    """Start the thread for a scheduled start of recording, when the `--start-at` or
+    `--countdown` option is selected.  The camera app should already be open.
+    Returns the thread, or `None` if no start is scheduled."""
+    if not (args().start_at or args().countdown):
+        return None
+    start_at_ns = (scheduled_start.parse_start_at(args().start_at[0])
+                   if args().start_at else None)
+    on_target_fun = None
+    if args().sync_daw_transport_with_video_recording:
+        if not is_daw_running():
+            print("\nWARNING: DAW is not detected as running for the scheduled start.",
+                  file=sys.stderr)
+        on_target_fun = start_daw_transport_for_recording
+    return scheduled_start.start_scheduled_start_thread(adb.tap_camera_button,
+                                  start_at_ns=start_at_ns,
+                                  countdown_secs=args().countdown[0] if args().countdown else None,
+                                  on_target_fun=on_target_fun,
+                                  log_event_fun=log_record_event)
 
 def start_monitoring_and_button_push_recording():
     """Emulate a button push to start and stop recording."""
     # Get a snapshot of save directory before recording starts.
     before_ls = adb.ls(args().camera_save_dir[0], extension_whitelist=[VIDEO_FILE_EXTENSION])
+    storage_monitor.clear_offloaded_video_paths()
 
-    if args().autorecord:
+    if args().storage_monitor:
+        storage_proc = storage_monitor.start_storage_monitor(before_ls)
+
+    scheduled_proc = start_scheduled_recording()
+    if args().autorecord and not scheduled_proc:
+        tap_ns = time.time_ns()
         adb.tap_camera_button()
+        log_record_event("record_start", tap_ns)
 
     if args().sync_daw_transport_with_video_recording:
         proc = sync_daw_transport_with_video_recording()
 
     start_screen_monitor() # This blocks until the screen monitor is closed.
+    log_record_event("monitor_closed", time.time_ns())
+    if scheduled_proc:
+        scheduled_start.scheduled_start_cancel(scheduled_proc)
 
     # If the user just shut down scrcpy while recording video, stop the recording.
     if adb.directory_size_increasing(args().camera_save_dir[0]):
+        tap_ns = time.time_ns()
         adb.tap_camera_button() # Presumably still recording; turn off the camera.
+        log_record_event("record_stop", tap_ns)
         #if args().sync_daw_transport_with_video_recording: # Now BG thread is still running to stop DAW transport.
         #    toggle_daw_transport() # Presumably the DAW transport is still rolling.
         while adb.directory_size_increasing(args().camera_save_dir[0]):
@@ -247,18 +393,29 @@ def start_monitoring_and_button_push_recording():
 
     if args().sync_daw_transport_with_video_recording:
         sync_daw_process_kill(proc)
+        stop_daw_transport_for_recording() # If the sync thread did not see the stop.
+    if args().storage_monitor:
+        storage_monitor.storage_monitor_kill(storage_proc)
 
     # Get a final snapshot of save directory after recording is finished.
     after_ls = adb.ls(args().camera_save_dir[0], extension_whitelist=[VIDEO_FILE_EXTENSION])
 
     new_video_files = [f for f in after_ls if f not in before_ls]
     new_video_paths = [os.path.join(args().camera_save_dir[0], v) for v in new_video_files]
-    return new_video_paths
+    # Videos offloaded during recording were recorded first, so they go first.
+    return storage_monitor.get_offloaded_video_paths() + new_video_paths
 
-def generate_video_name(video_number, pulled_vid_name):
-    """Generate the name to rename a pulled video to."""
+take_metadata = {} # Metadata about each pulled take, keyed by the local video path.
+
+def generate_video_name(video_number, pulled_vid_name, record_start_ns=None):
+    """Generate the name to rename a pulled video to.  The date and time are from
+    `record_start_ns` if it is passed in, otherwise the current time."""
     if args().date_and_time_in_video_name:
-        date_time_string = datetime.datetime.now().strftime('%Y-%m-%d_%H.%M.%S_')
+        if record_start_ns is not None:
+            date_time = datetime.datetime.fromtimestamp(record_start_ns / 1e9)
+        else:
+            date_time = datetime.datetime.now()
+        date_time_string = date_time.strftime('%Y-%m-%d_%H.%M.%S_')
     else:
         date_time_string = ""
     new_vid_name = f"{args().video_file_prefix}_{video_number:02d}_{date_time_string}{pulled_vid_name}"
@@ -270,39 +427,147 @@ def monitor_record_and_pull_videos(video_start_number):
         recorder_pid, video_path = start_screenrecording()
         start_screen_monitor()
         run_local_cmd_blocking(f"kill {recorder_pid}")
-        video_path = pull_and_delete_file(video_path)
+        video_path = adb.pull_and_delete_file(video_path)
         return [video_path]
 
     # Use the method requiring a button push on phone, emulated or actual.
     video_paths = start_monitoring_and_button_push_recording()
-    new_video_paths = []
     sleep(5) # Make sure video files have time to finish writing and close.
-    for count, vid in enumerate(video_paths):
-        pulled_vid = pull_and_delete_file(vid) # Note file always written to CWD for now.
-        sleep(0.3)
-        new_vid_name = generate_video_name(count+video_start_number, pulled_vid)
+    return pull_and_rename_videos(video_paths, video_start_number,
+                                  already_pulled=storage_monitor.get_offloaded_video_paths())
+
+def get_take_timing(video_path, mtime_host=None):
+    """Return a dict with the host times of the start and stop of recording for a
+    pulled video, from the device mtime mapped to host time as `(host_ns, error_ns)`
+    and the video duration.  The dict is empty if the times are unknown."""
+    if mtime_host is None:
+        return {}
+    duration = video_duration(video_path)
+    if duration is None:
+        return {}
+    stop_ns, error_ns = mtime_host # The file is last written when recording stops.
+    return {"record_start_ns": stop_ns - int(duration * 1e9),
+            "record_stop_ns": stop_ns,
+            "time_error_ns": error_ns,
+            "duration": duration}
+
+def print_take_timing(video_path):
+    """Print the host times of the start and stop of a take, and any recording
+    events logged during the take, relative to its start."""
+    timing = take_metadata.get(video_path, {})
+    if "record_start_ns" not in timing:
+        return
+    start_ns, stop_ns = timing["record_start_ns"], timing["record_stop_ns"]
+    error = clock_sync.format_ns(timing["time_error_ns"])
+    print(f"\nRecording start (host time): {clock_sync.format_host_time(start_ns)} ± {error}")
+    print(f"Recording stop  (host time): {clock_sync.format_host_time(stop_ns)} ± {error}")
+    if "scheduled_start_ns" in timing:
+        start_error_ns = start_ns - timing["scheduled_start_ns"]
+        print(f"Start error from the scheduled time: {start_error_ns/1e6:+.1f} ms ± {error}")
+    slack_ns = int(SYNC_DAW_SLEEP_TIME * 1e9) # Events are detected up to a poll late.
+    for e in record_events:
+        if start_ns - slack_ns <= e["latest_ns"] and e["earliest_ns"] <= stop_ns + slack_ns:
+            print(f"   {e['event']}: {(e['earliest_ns']-start_ns)/1e9:+.3f} to"
+                  f" {(e['latest_ns']-start_ns)/1e9:+.3f} s from recording start")
+
+def pull_videos(video_paths, already_pulled=()):
+    """Pull the videos at the remote `video_paths` to the CWD, deleting them from
+    the device.  Any paths in `already_pulled` are in the CWD already.  Returns a
+    list of dicts with the local and remote paths, the device mtime (if needed and
+    readable) and the checksum (if computed) of each video."""
+    need_mtime = args().join_split_segments or (args().clock_sync
+                                                 and clock_sync.clock_sync_estimate)
+    settle = not args().continuous # Continuous mode waits for the files to close instead.
+    pulled_videos = []
+    for vid in video_paths:
+        checksum = None
+        device_mtime_ns = None
+        if need_mtime and vid not in already_pulled:
+            device_mtime_ns = adb.remote_file_mtime_ns(vid)
+        if vid in already_pulled: # Offloaded by the storage monitor.
+            pulled_vid = os.path.basename(vid)
+        elif args().stream_pull:
+            pulled_vid, checksum = adb.stream_pull_file(vid)
+            adb.delete_file(vid, settle=settle)
+        else:
+            # Note file always written to CWD for now.
+            pulled_vid = adb.pull_and_delete_file(vid, settle=settle)
+        if settle:
+            sleep(0.3)
+        pulled_videos.append({"local_path": pulled_vid, "remote_path": vid,
+                              "device_mtime_ns": device_mtime_ns, "sha256": checksum})
+    return pulled_videos
+
+def pull_and_rename_videos(video_paths, video_start_number, already_pulled=()):
+    """Pull the videos at the remote `video_paths`, deleting them from the device,
+    and rename them with numbers starting at `video_start_number`.  Any paths in
+    `already_pulled` are in the CWD already and are only renamed.  Split segments
+    of a recording are joined first when that option is selected.  Returns the
+    list of local video paths."""
+    pulled_videos = pull_videos(video_paths, already_pulled)
+    if args().join_split_segments:
+        pulled_videos = segment_join.join_split_segments(pulled_videos)
+
+    scheduled_start_ns = scheduled_start.pop_scheduled_start_ns()
+    new_video_paths = []
+    for count, pulled in enumerate(pulled_videos):
+        pulled_vid, checksum = pulled["local_path"], pulled["sha256"]
+        mtime_host = None
+        if (args().clock_sync and clock_sync.clock_sync_estimate
+                              and pulled["device_mtime_ns"] is not None):
+            mtime_host = clock_sync.device_to_host_ns(pulled["device_mtime_ns"])
+        timing = get_take_timing(pulled_vid, mtime_host)
+        new_vid_name = generate_video_name(count+video_start_number, pulled_vid,
+                                           timing.get("record_start_ns"))
         print(f"\nSaving (renaming) video file as\n   {new_vid_name}")
         os.rename(pulled_vid, new_vid_name)
         new_video_paths.append(new_vid_name)
+        take_metadata[new_vid_name] = {"remote_path": pulled["remote_path"],
+                                       "sha256": checksum,
+                                       "prefix": args().video_file_prefix,
+                                       "number": count+video_start_number}
+        if "segment_remote_paths" in pulled:
+            take_metadata[new_vid_name]["segment_remote_paths"] = pulled["segment_remote_paths"]
+        take_metadata[new_vid_name].update(timing)
+        if count == 0 and scheduled_start_ns is not None:
+            take_metadata[new_vid_name]["scheduled_start_ns"] = scheduled_start_ns
+            if "record_start_ns" not in timing:
+                print("\nSelect the `--clock-sync` option to measure the error of the"
+                      " scheduled start from the video file.")
+        print_take_timing(new_vid_name)
+        if args().trim_dead_time:
+            take_trim.trim_take(new_vid_name, take_metadata[new_vid_name], record_events)
+        if args().catalog:
+            catalog_pulled_video(new_vid_name)
+        hooks.run_hooks("on_file_pulled", new_vid_name, take_metadata[new_vid_name])
+        if checksum:
+            print(f"\nSHA-256 checksum: {checksum}")
+        if args().stream_pull and not QUERY_EXTRACT_AUDIO:
+            extract_audio_from_video(new_vid_name) # Video data is still in the page cache.
     return new_video_paths
 
+def catalog_pulled_video(video_path):
+    """Add a pulled video to the take catalog, saving the row ID in its metadata."""
+    metadata = take_metadata[video_path]
+    metadata["ffprobe"] = ffprobe_metadata(video_path)
+    if not metadata.get("sha256"): # Only streaming pulls hash during the transfer.
+        metadata["sha256"] = file_sha256(video_path)
+    metadata["catalog_id"] = take_catalog.add_take(metadata["prefix"], metadata["number"],
+                                                   video_path, metadata,
+                                                   args().catalog_path[0])
+
+def update_catalog(video_paths):
+    """Update the catalog rows of the videos with the metadata found while
+    processing them, such as the audio path."""
+    for vid in video_paths:
+        metadata = take_metadata.get(vid, {})
+        if "catalog_id" in metadata:
+            take_catalog.update_take(metadata["catalog_id"], metadata, args().catalog_path[0])
+
 #
 # Video postprocessing functions.
 #
 
-def pull_and_delete_file(pathname):
-    """Pull the file at the pathname and delete the remote file.  Returns the
-    path of the extracted video."""
-    # Pull.
-    adb.adb(f"adb pull {pathname}")
-
-    # Delete.
-    sleep(4)
-    adb.adb(f"adb shell rm {pathname}")
-    sleep(1)
-    adb.adb(f"adb -d shell am broadcast -a android.intent.action.MEDIA_SCANNER_SCAN_FILE -d file:{pathname}")
-    return os.path.basename(pathname)
-
 PREVIEW_WINDOW_ALWAYS_ON_TOP = False # TODO, possible feature.  But preview blocking messes it up...
 SET_ACTIVE_WINDOW_ALWAYS_ON_TOP_CMD = ["wmctrl", "-r", ":ACTIVE:", "-b", "toggle,above"]
 
@@ -333,6 +598,8 @@ def extract_audio_from_video(video_path):
     if not ((args().audio_extract or QUERY_EXTRACT_AUDIO) and os.path.isfile(video_path)
                                                    and not USE_SCREENRECORD):
         return
+    if take_metadata.get(video_path, {}).get("audio_path"):
+        return # Already extracted right after the pull.
     if QUERY_EXTRACT_AUDIO and not query_yes_no("\nExtract audio from video? "):
         return
 
@@ -344,16 +611,32 @@ def extract_audio_from_video(video_path):
     cmd = f"ffmpeg -i {video_path} -map 0:a {output_audio_path} -loglevel quiet"
     run_local_cmd_blocking(cmd, print_cmd=True, print_cmd_prefix="SYSTEM: ",
                            capture_output=False)
+    take_metadata.setdefault(video_path, {})["audio_path"] = output_audio_path
     print("\nAudio extracted.")
 
 def postprocess_video_file(video_path):
     """Run a postprocessing algorithm on the video file at `video_path`."""
-    if not POSTPROCESS_VIDEOS or not os.path.isfile(video_path):
+    if not os.path.isfile(video_path):
+        return
+    hooks.run_hooks("on_postprocess", video_path, take_metadata.setdefault(video_path, {}))
+    if not POSTPROCESS_VIDEOS:
         return
     postprocess_cmd = POSTPROCESSING_CMD + [f"{video_path}"]
     run_local_cmd_blocking(postprocess_cmd, print_cmd=True, print_cmd_prefix="SYSTEM: ",
                            capture_output=False)
 
+def analyze_audio_of_videos(video_paths):
+    """Analyze the audio extracted from the videos and print a ranked summary."""
+    audio_paths = {take_metadata[v]["audio_path"]: v for v in video_paths
+                               if take_metadata.get(v, {}).get("audio_path")}
+    if video_paths and not audio_paths:
+        print("\nWARNING: No extracted audio to analyze; the --analyze-audio option"
+              " requires audio extraction (--audio-extract).", file=sys.stderr)
+        return
+    results = audio_analysis.analyze_audio_files(list(audio_paths))
+    for audio_path, analysis in results.items():
+        take_metadata[audio_paths[audio_path]]["audio_analysis"] = analysis
+
 def print_info_about_pulled_video(video_path):
     """Print out some information about the resolution, etc., of a video."""
     # To get JSON: ffprobe -v quiet -print_format json -show_format -show_streams "lolwut.mp4" > "lolwut.mp4.json"
@@ -367,6 +650,26 @@ def print_info_about_pulled_video(video_path):
     if stderr:
         print(indent_lines(stderr, 4))
 
+def process_pulled_videos(video_paths):
+    """Run the info, preview, audio-extraction and postprocessing stages on each of
+    the pulled videos."""
+    for vid in video_paths:
+        print(f"\n{'='*12} {vid} {'='*30}")
+        print_info_about_pulled_video(vid)
+        if args().contact_sheets:
+            contact_sheets.submit_contact_sheet(vid)
+        preview_video(vid)
+        extract_audio_from_video(vid)
+        postprocess_video_file(vid)
+
+    if args().analyze_audio:
+        analyze_audio_of_videos(video_paths)
+    if args().contact_sheets:
+        contact_sheets.wait_for_contact_sheets()
+    if args().catalog:
+        update_catalog(video_paths)
+    hooks.run_hooks("on_takes_processed", {v: take_metadata.get(v, {}) for v in video_paths})
+
 #
 # High-level functions.
 #
@@ -379,27 +682,189 @@ def startup_device_and_run(video_start_number):
     adb.open_video_camera()
     if args().raise_daw_on_camera_app_open:
         raise_daw_in_window_stack()
+    if args().clock_sync:
+        clock_sync.estimate_clock_offset()
 
     video_paths = monitor_record_and_pull_videos(video_start_number)
     adb.device_sleep() # Put the device to sleep after use.
 
-    for vid in video_paths:
-        print(f"\n{'='*12} {vid} {'='*30}")
-        print_info_about_pulled_video(vid)
-        preview_video(vid)
-        extract_audio_from_video(vid)
-        postprocess_video_file(vid)
+    process_pulled_videos(video_paths)
 
     video_end_number = video_start_number + len(video_paths) - 1
     return video_end_number
 
+def start_hotkey_reader():
+    """Start a thread which puts each line typed in the terminal onto a queue,
+    which is returned."""
+    hotkey_queue = queue.Queue()
+    def read_lines():
+        for line in sys.stdin:
+            hotkey_queue.put(line.strip().lower())
+        hotkey_queue.put("q") # End of input.
+    proc = threading.Thread(target=read_lines)
+    proc.daemon = True # This is so the thread always dies when the main program exits.
+    proc.start()
+    return hotkey_queue
+
+def pull_and_process_new_videos(before_ls, video_start_number):
+    """Pull and process the videos not in `before_ls`, along with any offloaded
+    by the storage monitor.  Returns the number of videos pulled."""
+    # OpenCamera renames the `.pending` file when the video is closed, so wait for that
+    # rather than sleeping a fixed time.  A take started since may keep one open.
+    settle_deadline = time.monotonic() + CONTINUOUS_PULL_SETTLE_TIMEOUT
+    while (adb.pending_video_file_exists(args().camera_save_dir[0])
+           and time.monotonic() < settle_deadline):
+        sleep(0.1)
+    with storage_monitor.offload_pull_lock:
+        after_ls = adb.ls(args().camera_save_dir[0],
+                          extension_whitelist=[VIDEO_FILE_EXTENSION])
+        new_video_paths = [os.path.join(args().camera_save_dir[0], v)
+                                            for v in after_ls if v not in before_ls]
+        offloaded_video_paths = storage_monitor.pop_offloaded_video_paths()
+        video_paths = pull_and_rename_videos(offloaded_video_paths + new_video_paths,
+                                             video_start_number,
+                                             already_pulled=offloaded_video_paths)
+    process_pulled_videos(video_paths)
+    return len(video_paths)
+
+def tap_camera_button_or_warn():
+    """Tap the camera button, printing a warning rather than raising `AdbError` if
+    it fails, so a continuous session keeps running.  Returns true on success."""
+    try:
+        adb.tap_camera_button()
+    except adb.AdbError as e:
+        print(f"\nWARNING: Camera button tap failed: {e}", file=sys.stderr)
+        return False
+    return True
+
+def run_continuous_loop(video_start_number):
+    """Keep the camera app open and the scrcpy monitor running, pulling and
+    processing the videos each time recording is detected to stop.  Pressing
+    Enter in the terminal starts or stops recording, and 'q' quits.  Returns the
+    last video number used."""
+    adb.device_sleep() # Get a consistent starting state for repeatability.
+    adb.device_wakeup()
+    adb.unlock_screen()
+    adb.open_video_camera()
+    if args().raise_daw_on_camera_app_open:
+        raise_daw_in_window_stack()
+    if args().clock_sync:
+        clock_sync.estimate_clock_offset()
+
+    before_ls = adb.ls(args().camera_save_dir[0], extension_whitelist=[VIDEO_FILE_EXTENSION])
+    storage_monitor.clear_offloaded_video_paths()
+    if args().storage_monitor:
+        storage_proc = storage_monitor.start_storage_monitor(before_ls)
+    monitor_proc = start_screen_monitor_bg()
+    hotkey_queue = start_hotkey_reader()
+    print("\nContinuous mode: press Enter to start or stop recording, or 'q' then Enter"
+          " to quit.")
+
+    scheduled_proc = start_scheduled_recording()
+    if args().autorecord and not scheduled_proc:
+        tap_camera_button_or_warn()
+
+    recording = False
+    prev_poll_ns = time.time_ns() # A change happened between the previous poll and this one.
+    while monitor_proc.is_alive():
+        try:
+            hotkey = hotkey_queue.get(timeout=CONTINUOUS_POLL_TIME)
+        except queue.Empty:
+            hotkey = None
+        if hotkey in {"q", "quit"}:
+            break
+        if hotkey == "":
+            tap_camera_button_or_warn()
+
+        if not adb.feature_available("Record detection"):
+            continue # Paused after repeated ADB failures.
+        poll_ns = time.time_ns()
+        try:
+            vid_recording = video_is_recording_on_device()
+        except adb.AdbError as e:
+            adb.record_feature_failure("Record detection", e)
+            continue
+        adb.record_feature_success("Record detection")
+        if vid_recording != recording:
+            log_record_event("record_start" if vid_recording else "record_stop", prev_poll_ns)
+        prev_poll_ns = poll_ns
+        if vid_recording and not recording:
+            print("\nRecording detected.")
+            if args().sync_daw_transport_with_video_recording:
+                start_daw_transport_for_recording()
+            recording = True
+        elif recording and not vid_recording:
+            print("\nRecording stopped.")
+            if args().sync_daw_transport_with_video_recording:
+                stop_daw_transport_for_recording()
+            recording = False
+            # Pulled videos are deleted from the device, so `before_ls` stays the startup
+            # listing; takes finished during a pull are caught by the next one.
+            video_start_number += pull_and_process_new_videos(before_ls, video_start_number)
+            print("\nReady for the next take.")
+
+    if scheduled_proc:
+        scheduled_start.scheduled_start_cancel(scheduled_proc)
+    if recording: # Quit or closed the monitor while still recording.
+        tap_ns = time.time_ns()
+        if tap_camera_button_or_warn():
+            log_record_event("record_stop", tap_ns)
+        else:
+            print("Stop the recording on the device to finish.")
+        if args().sync_daw_transport_with_video_recording:
+            stop_daw_transport_for_recording()
+        while adb.directory_size_increasing(args().camera_save_dir[0]):
+            print("Waiting for save directory to stop increasing in size...")
+            sleep(1)
+    if args().storage_monitor:
+        storage_monitor.storage_monitor_kill(storage_proc)
+    video_start_number += pull_and_process_new_videos(before_ls, video_start_number)
+    adb.device_sleep() # Put the device to sleep after use.
+    return video_start_number - 1
+
 def main():
+    """Run the program, exiting with an error message if an ADB command fails."""
+    try:
+        main_loop()
+    except adb.AdbError as e:
+        print(f"\nERROR: {e}", file=sys.stderr)
+        sys.exit(1)
+    finally:
+        hooks.wait_for_hooks() # Let background hooks from the config file finish.
+
+def main_loop():
     """Outer loop over invocations of the scrcpy screen monitor."""
     parse_command_line()
+    if args().trim_dead_time:
+        args().clock_sync = True # The trim needs the host times of the takes.
+
+    if args().daemon_cmd:
+        from . import daemon_mode
+        daemon_mode.send_daemon_command(args().daemon_cmd[0])
+        return
+
+    if args().catalog_query is not None:
+        take_catalog.catalog_main(args().catalog_query)
+        return
 
     video_start_number = args().numbering_start[0]
+    if video_start_number is None:
+        video_start_number = (take_catalog.next_video_number(args().video_file_prefix,
+                                                             args().catalog_path[0])
+                                  if args().catalog else 1)
     print_startup_message()
 
+    if args().daemon:
+        from . import daemon_mode
+        daemon_mode.run_daemon(video_start_number)
+        print("\nExiting recdroidvid.")
+        return
+
+    if args().continuous:
+        run_continuous_loop(video_start_number)
+        print("\nExiting recdroidvid.")
+        return
+
     count = 0
     while True:
         count += 1
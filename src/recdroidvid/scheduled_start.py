@@ -0,0 +1,151 @@
+"""
+
+Start recording at a scheduled host time.  Everything is set up beforehand, and
+the latency of an ADB keyevent is measured with a harmless keyevent.  The record
+keyevent is then issued that much before the target time, so it lands on the
+device at the target.  The thread sleeps until just before the issue time and
+busy-waits the rest, since sleeps can overshoot by milliseconds.
+
+"""
+
+import sys
+import time
+import datetime
+import threading
+import statistics
+from time import sleep
+
+from .settings_and_options import (SCHEDULED_START_LATENCY_SAMPLES,
+                SCHEDULED_START_BUSY_WAIT)
+from . import adb_commands as adb
+from .clock_sync import format_ns, format_host_time
+
+START_AT_FORMATS = ["%H:%M", "%H:%M:%S", "%H:%M:%S.%f", "%Y-%m-%d %H:%M",
+                    "%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%dT%H:%M",
+                    "%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f"]
+
+scheduled_start_ns = None # The target host time of the last scheduled start.
+scheduled_start_cancel_flag = False # Flag to signal the scheduled start thread to cancel.
+
+def parse_start_at(text):
+    """Parse a time of day, or a date and time, to a host time in ns.  A time of day
+    alone is for today."""
+    for start_at_format in START_AT_FORMATS:
+        try:
+            date_time = datetime.datetime.strptime(text, start_at_format)
+        except ValueError:
+            continue
+        if date_time.year == 1900: # No date was given.
+            date_time = datetime.datetime.combine(datetime.date.today(), date_time.time())
+        return int(date_time.timestamp() * 1e9)
+    print(f"\nERROR: Could not parse the start time '{text}'; use HH:MM[:SS[.ffffff]],"
+          f" optionally preceded by the date as YYYY-MM-DD.", file=sys.stderr)
+    sys.exit(1)
+
+def measure_keyevent_latency(num_samples=SCHEDULED_START_LATENCY_SAMPLES):
+    """Estimate the time in ns from issuing an ADB keyevent command to the key being
+    injected on the device.  Most of a keyevent's round trip is the device starting
+    the `input` command, and the key is injected at the end, so the estimate is the
+    median keyevent round trip less the one-way return time (half of the smallest
+    plain ADB round trip).  Returns the tuple `(latency_ns, jitter_ns)`."""
+    def round_trip_ns(cmd):
+        start_ns = time.perf_counter_ns()
+        adb.adb(cmd, print_cmd=False)
+        return time.perf_counter_ns() - start_ns
+    print(f"\nMeasuring the ADB keyevent latency from {num_samples} samples...")
+    transport_ns = min(round_trip_ns("adb shell true") for i in range(num_samples))
+    keyevent_ns = [round_trip_ns("adb shell input keyevent KEYCODE_UNKNOWN")
+                   for i in range(num_samples)]
+    latency_ns = int(statistics.median(keyevent_ns)) - transport_ns // 2
+    jitter_ns = int(statistics.pstdev(keyevent_ns))
+    print(f"ADB keyevent latency: {format_ns(latency_ns)} (jitter {format_ns(jitter_ns)})")
+    return latency_ns, jitter_ns
+
+def wait_until_ns(target_ns, countdown=True):
+    """Sleep until `SCHEDULED_START_BUSY_WAIT` seconds before the host time
+    `target_ns`, then busy-wait until it.  Prints a countdown of the last ten
+    seconds if `countdown` is true.  Returns false if the start is cancelled
+    during the sleep."""
+    busy_wait_ns = int(SCHEDULED_START_BUSY_WAIT * 1e9)
+    last_printed = None
+    while True:
+        if scheduled_start_cancel_flag:
+            return False
+        remaining_ns = target_ns - time.time_ns()
+        if remaining_ns <= busy_wait_ns:
+            break
+        seconds_left = -(-remaining_ns // 1_000_000_000) # Rounded up.
+        if countdown and seconds_left <= 10 and seconds_left != last_printed:
+            print(f"Recording starts in {seconds_left} s...")
+            last_printed = seconds_left
+        # Wake at the next whole second before the target, or for the busy-wait.
+        sleep_ns = remaining_ns - busy_wait_ns
+        if sleep_ns > 1_000_000_000:
+            sleep_ns = remaining_ns % 1_000_000_000 or 1_000_000_000
+        sleep(sleep_ns / 1e9)
+    while time.time_ns() < target_ns:
+        pass
+    return True
+
+def run_scheduled_start(target_ns, latency_ns, tap_fun, on_target_fun=None,
+                        log_event_fun=None):
+    """Issue the record keyevent with `tap_fun` at `latency_ns` before the host time
+    `target_ns`, and run `on_target_fun` (such as starting the DAW transport) at the
+    target.  The event is logged by `log_event_fun(event, earliest_ns, latest_ns)`
+    with the time bounds of the tap.  Prints the scheduling error."""
+    issue_target_ns = target_ns - latency_ns
+    if issue_target_ns < time.time_ns():
+        print("\nWARNING: The scheduled start time has passed, starting recording now.",
+              file=sys.stderr)
+    if not wait_until_ns(issue_target_ns):
+        print("\nScheduled start cancelled.")
+        return
+
+    issue_ns = time.time_ns()
+    tap_thread = threading.Thread(target=tap_fun) # Returns about when the key lands.
+    tap_thread.start()
+    if on_target_fun and wait_until_ns(target_ns, countdown=False): # Skip if cancelled.
+        on_target_fun()
+    tap_thread.join()
+    return_ns = time.time_ns()
+    if log_event_fun:
+        log_event_fun("record_start", issue_ns, return_ns)
+
+    print(f"\nRecord keyevent issued {format_ns(issue_ns - issue_target_ns)} after its"
+          f" scheduled time; estimated to land at {format_host_time(issue_ns + latency_ns)},"
+          f" {format_ns(issue_ns + latency_ns - target_ns)} from the target.")
+
+def start_scheduled_start_thread(tap_fun, start_at_ns=None, countdown_secs=None,
+                                 on_target_fun=None, log_event_fun=None):
+    """Measure the keyevent latency and start a thread which starts recording at the
+    host time `start_at_ns`, or `countdown_secs` seconds after the measurement.
+    Returns the thread."""
+    global scheduled_start_ns, scheduled_start_cancel_flag
+    latency_ns, jitter_ns = measure_keyevent_latency()
+    if start_at_ns is not None:
+        target_ns = start_at_ns
+    else:
+        target_ns = time.time_ns() + int(countdown_secs * 1e9)
+    scheduled_start_ns = target_ns
+    scheduled_start_cancel_flag = False
+    print(f"\nRecording scheduled to start at {format_host_time(target_ns)}.")
+    proc = threading.Thread(target=run_scheduled_start,
+                            args=(target_ns, latency_ns, tap_fun, on_target_fun,
+                                  log_event_fun))
+    proc.daemon = True # This is so the thread always dies when the main program exits.
+    proc.start()
+    return proc
+
+def scheduled_start_cancel(proc):
+    """Cancel the scheduled start if it has not fired yet, and wait for the thread
+    to finish."""
+    global scheduled_start_cancel_flag
+    scheduled_start_cancel_flag = True
+    proc.join()
+
+def pop_scheduled_start_ns():
+    """Return the target time of the last scheduled start, or `None`, and clear it."""
+    global scheduled_start_ns
+    target_ns = scheduled_start_ns
+    scheduled_start_ns = None
+    return target_ns
@@ -0,0 +1,127 @@
+"""
+
+Join the segments of recordings which the camera app split into several files
+(OpenCamera splits at the file-size limit).  Consecutive pulled videos are
+taken to be segments of one recording when each one starts, by the device
+clock, where the previous one stopped and their streams have the same
+parameters.  Segments are joined with the ffmpeg concat demuxer in stream-copy
+mode, so nothing is re-encoded.
+
+"""
+
+import sys
+import os
+
+from .settings_and_options import SEGMENT_JOIN_MAX_GAP
+from .utility_functions import run_local_cmd_blocking, ffprobe_metadata, file_sha256
+
+# Stream fields which must match for segments to be joined by stream copy.
+STREAM_MATCH_FIELDS = ["codec_type", "codec_name", "profile", "width", "height", "pix_fmt",
+                       "time_base", "sample_rate", "channels", "channel_layout"]
+
+def stream_parameters(metadata):
+    """Return a tuple of the stream parameters which must match to join videos,
+    from the parsed ffprobe output."""
+    return tuple(tuple(s.get(f) for f in STREAM_MATCH_FIELDS)
+                 for s in metadata.get("streams", []))
+
+def probe_segment(video):
+    """Add the duration and stream parameters from ffprobe to a pulled-video dict.
+    Returns false if the video cannot be probed."""
+    metadata = ffprobe_metadata(video["local_path"])
+    try:
+        video["duration"] = float(metadata["format"]["duration"])
+    except (TypeError, KeyError, ValueError):
+        return False
+    video["stream_parameters"] = stream_parameters(metadata)
+    return True
+
+def is_next_segment(prev, video):
+    """Return true if `video` continues the recording of `prev`: it starts within
+    `SEGMENT_JOIN_MAX_GAP` seconds of where `prev` stopped, by the device mtimes
+    (when each file was last written) and durations, and the streams match."""
+    if prev["device_mtime_ns"] is None or video["device_mtime_ns"] is None:
+        return False
+    start_ns = video["device_mtime_ns"] - int(video["duration"] * 1e9)
+    gap = (start_ns - prev["device_mtime_ns"]) / 1e9
+    return (abs(gap) <= SEGMENT_JOIN_MAX_GAP
+                and video["stream_parameters"] == prev["stream_parameters"])
+
+def group_segments(videos):
+    """Group the pulled videos, in recording order, into lists of the segments of
+    each recording."""
+    groups = []
+    prev = None
+    for video in videos:
+        if not probe_segment(video):
+            groups.append([video])
+            prev = None
+            continue
+        if prev is not None and is_next_segment(prev, video):
+            groups[-1].append(video)
+        else:
+            groups.append([video])
+        prev = video
+    return groups
+
+def concat_segments(segment_paths):
+    """Join the videos at `segment_paths` in stream-copy mode with the ffmpeg concat
+    demuxer.  Returns the path of the joined video, or `None` on failure."""
+    root_name, video_extension = os.path.splitext(segment_paths[0])
+    joined_path = f"{root_name}_joined{video_extension}"
+    list_path = f"{root_name}_concat_list.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in segment_paths:
+            quoted_path = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{quoted_path}'\n")
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-f", "concat", "-safe", "0",
+           "-i", list_path, "-map", "0", "-c", "copy", joined_path]
+    returncode, stdout, stderr = run_local_cmd_blocking(cmd, print_cmd=True,
+                                       print_cmd_prefix="SYSTEM: ", fail_on_nonzero_exit=False)
+    os.remove(list_path)
+    if returncode != 0 or not os.path.isfile(joined_path):
+        print(f"\nWARNING: Joining the segments failed, keeping them separate:\n{stderr}",
+              file=sys.stderr)
+        if os.path.isfile(joined_path):
+            os.remove(joined_path)
+        return None
+    return joined_path
+
+def join_segment_group(group):
+    """Join a group of segments, deleting the segment files once the joined file is
+    checked.  Returns the pulled-video dict for the joined video, or `None` if the
+    segments could not be joined."""
+    segment_paths = [v["local_path"] for v in group]
+    print(f"\nJoining {len(group)} segments of one recording:")
+    for path in segment_paths:
+        print(f"   {path}")
+    joined_path = concat_segments(segment_paths)
+    if joined_path is None:
+        return None
+    total_duration = sum(v["duration"] for v in group)
+    joined = {"local_path": joined_path, "remote_path": group[0]["remote_path"],
+              "segment_remote_paths": [v["remote_path"] for v in group],
+              "device_mtime_ns": group[-1]["device_mtime_ns"], "sha256": None}
+    if not probe_segment(joined) or abs(joined["duration"] - total_duration) > (
+                                                          SEGMENT_JOIN_MAX_GAP * len(group)):
+        print(f"\nWARNING: The joined video '{joined_path}' does not have the total duration"
+              f" of the segments, keeping them separate.", file=sys.stderr)
+        os.remove(joined_path)
+        return None
+    if any(v["sha256"] for v in group): # Checksums were wanted, so make one for the join.
+        joined["sha256"] = file_sha256(joined_path)
+    for path in segment_paths:
+        os.remove(path)
+    print(f"\nSegments joined into '{joined_path}' ({joined['duration']:.1f} s).")
+    return joined
+
+def join_split_segments(videos):
+    """Join any consecutive pulled videos which are segments of one recording.  The
+    `videos` are dicts with the keys "local_path", "remote_path", "device_mtime_ns"
+    and "sha256", in recording order.  Returns the list of dicts for the videos
+    after joining."""
+    joined_videos = []
+    for group in group_segments(videos):
+        joined = join_segment_group(group) if len(group) > 1 else None
+        joined_videos.extend([joined] if joined else group)
+    return joined_videos
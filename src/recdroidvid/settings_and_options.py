@@ -24,6 +24,18 @@ SCRCPY_CMD_DEFAULT = ["scrcpy", "--stay-awake",
                                 "--max-size=1200",
                                 "--lock-video-orientation=initial",]
 
+# Monitor profiles for the --adaptive-monitor-profile option, from heaviest to lightest.
+# Their options replace any of the same options in the scrcpy command.
+SCRCPY_MONITOR_PROFILES = [("full", ["--max-size=1200", "--display-buffer=20"]),
+                           ("medium", ["--max-size=900", "--max-fps=30", "--bit-rate=4M",
+                                       "--display-buffer=20"]),
+                           ("light", ["--max-size=600", "--max-fps=15", "--bit-rate=2M",
+                                      "--display-buffer=20"]),]
+MONITOR_PROFILE_CPU_THRESHOLD = 75 # Host CPU percent above which the host is overloaded.
+MONITOR_PROFILE_SAMPLE_TIME = 2 # Seconds between samples of the host load.
+MONITOR_PROFILE_OVERLOAD_SAMPLES = 3 # Consecutive overloaded samples before going lighter.
+JACK_XRUN_COUNT_CMD = "" # Cmd printing the cumulative Jack xrun count; empty to not use.
+
 BASE_VIDEO_PLAYER_CMD = ["mpv", "--loop=inf",
                                 "--autofit=1080", # Set the width of displayed video.
                                 #"--geometry=50%:70%", # Set initial position on screen.
@@ -45,6 +57,27 @@ QUERY_EXTRACT_AUDIO = False # Ask before extracting AUDIO file.
 
 EXTRACTED_AUDIO_EXTENSION = ".wav"
 
+CLOCK_SYNC_SAMPLES = 20 # Number of device clock samples for each clock offset estimate.
+CLOCK_SYNC_BEST_FRACTION = 0.25 # Fraction of samples, smallest round trips, that are used.
+
+CONTACT_SHEET_TILES = "4x4" # Columns x rows of frames in each contact sheet.
+CONTACT_SHEET_FRAME_WIDTH = 320 # Width in pixels of each frame in a contact sheet.
+CONTACT_SHEET_WORKERS = 2 # Number of contact sheets built at the same time.
+CONTACT_SHEET_SUFFIX = "_contact_sheet.jpg" # Replaces the video extension.
+
+ANALYSIS_CHUNK_SECONDS = 10 # Audio is analyzed in chunks of this length, to bound memory.
+ANALYSIS_CLIP_LEVEL = 0.999 # Samples with at least this absolute value count as clipped.
+ANALYSIS_SILENCE_PEAK_DBFS = -50 # Takes with lower peaks are flagged as silent.
+ANALYSIS_ENVELOPE_POINTS = 200 # Number of points in the downsampled waveform envelope.
+ANALYSIS_WORKERS = None # Number of analysis processes; None uses the number of CPUs.
+
+STREAM_PULL_BLOCK_SIZE = 8 * 1024 * 1024 # Read/write block size for streaming pulls.
+
+SEGMENT_JOIN_MAX_GAP = 2 # Max seconds between split segments of one recording.
+
+TRIM_MARGIN = 0.5 # Seconds of dead time kept at each end of a trimmed take, for safety.
+TRIM_MIN_SECONDS = 1 # Takes are not trimmed unless at least this many seconds are cut.
+
 IS_DAW_RUNNING_CMD = 'xdotool search --onlyvisible --class Ardour'
 TOGGLE_DAW_TRANSPORT_CMD = 'xdotool key --window "$(xdotool search --onlyvisible --class Ardour | head -1)" space'
 #TOGGLE_DAW_TRANSPORT_CMD = 'xdotool windowactivate "$(xdotool search --onlyvisible --class Ardour | head -1)"'
@@ -53,8 +86,38 @@ ADD_DAW_MARK_CMD = 'xdotool key --window "$(xdotool search --onlyvisible --class
 
 RAISE_DAW_TO_TOP_CMD = "xdotool search --onlyvisible --class Ardour windowactivate %@"
 
+ADB_CMD_TIMEOUT = 30 # Seconds before an ADB command is killed (pulls use the stall timeout).
+ADB_TRANSFER_STALL_TIMEOUT = 30 # Seconds without progress before a pull is killed.
+ADB_RETRIES = 3 # Number of retries of an ADB command after a transient failure.
+ADB_RETRY_BACKOFF = 1 # Seconds before the first retry; doubled for each later one.
+ADB_WAIT_FOR_DEVICE_TIMEOUT = 30 # Seconds to wait for the device to reconnect.
+# ADB errors which mean the command never reached the device.
+ADB_UNREACHED_ERROR_STRINGS = ["error: no devices", "error: device offline",
+                               "error: device not found", "error: device '",
+                               "error: device still authorizing", "cannot connect to daemon"]
+# ADB errors which may have happened partway through, after reaching the device.
+ADB_TRANSIENT_ERROR_STRINGS = ["protocol fault", "error: closed", "connection reset",
+                               "Broken pipe"]
+CIRCUIT_BREAKER_MAX_FAILURES = 3 # Failures in a row before a background feature pauses.
+CIRCUIT_BREAKER_PAUSE_TIME = 30 # Seconds that a failing background feature pauses.
+
+DAW_CMD_TIMEOUT = 10 # Seconds before a DAW command (toggle transport, etc.) is killed.
+
+HOOK_WORKERS = 4 # Number of threads running background hooks from the config file.
+
 SYNC_DAW_SLEEP_TIME = 4 # Lag between video on/off & DAW transport sync (load/time tradeoff)
 
+SCHEDULED_START_LATENCY_SAMPLES = 5 # Samples of the ADB keyevent latency for scheduled starts.
+SCHEDULED_START_BUSY_WAIT = 0.02 # Seconds busy-waited (not slept) before a scheduled start.
+
+CONTINUOUS_POLL_TIME = 0.5 # Seconds between record-state polls in continuous mode.
+CONTINUOUS_PULL_SETTLE_TIMEOUT = 2 # Max seconds to wait for .pending files to close, continuous mode.
+
+STORAGE_MONITOR_SLEEP_TIME = 10 # Seconds between checks of free space on the device.
+DEFAULT_VIDEO_WRITE_RATE_MB_PER_MIN = 360 # Assumed until a write rate is observed (~48 Mbps).
+MIN_RECORDING_WRITE_RATE_MB_PER_SEC = 0.5 # Smaller drops in free space are not from recording.
+STORAGE_WARNING_MINUTES = 10 # Warn when fewer estimated recording minutes than this remain.
+
 #RECORD_DETECTION_METHOD = "directory size increasing" # More general but requires two calls.
 RECORD_DETECTION_METHOD = ".pending filename prefix" # May be specific to OpenCamera implemetation.
 
@@ -68,6 +131,10 @@ POSTPROCESSING_CMD = [] # Enter cmd as separate string arguments.
 
 RECDROIDVID_PYTHON_RC_FILENAME = ".recdroidvid_rc.py"
 
+DAEMON_SOCKET_PATH = "~/.recdroidvid_daemon.sock" # Unix socket for daemon-mode commands.
+
+CATALOG_PATH = "~/.recdroidvid_catalog.sqlite3" # SQLite catalog of all the pulled takes.
+
 import sys
 import os
 import argparse
@@ -123,13 +190,24 @@ def parse_command_line():
                         including arguments, to be used to launch the scrcpy program.
                         Otherwise a default version is used with some common arguments.
                         Note that the string `--window-title=RDV_SCRCPY_TITLE` can be used
-                        to substitute-in a more descriptive title for the window.""")
+                        to substitute-in a more descriptive title for the window.  The
+                        title is quoted for the shell when it is substituted, so any quotes
+                        directly around `RDV_SCRCPY_TITLE` are removed.""")
+
+    parser.add_argument("--adaptive-monitor-profile", action="store_true", default=False,
+                        help="""Sample the computer's CPU load (and the Jack xrun count, if
+                        a command to get it is configured) while scrcpy runs, and restart
+                        scrcpy with a lighter monitor profile (smaller size, lower frame
+                        rate and bit rate) when the load stays too high.  The profiles used
+                        and their CPU costs are printed when scrcpy is closed.""")
 
     parser.add_argument("--numbering-start", "-n", type=int, nargs=1, metavar="INTEGER",
-                        default=[1], help="""The number at which to start numbering
+                        default=[None], help="""The number at which to start numbering
                         pulled videos.  The number is currently appended to the user-defined
                         prefix and defaults to 1.  Allows for restarting and continuing
-                        a naming sequence across invocations of the program.""")
+                        a naming sequence across invocations of the program.  With the
+                        `--catalog` option the default is instead the number after the
+                        highest one cataloged for the prefix.""")
 
     parser.add_argument("--loop", "-l", action="store_true",
                         default=False, help="""Loop the recording, querying between
@@ -141,10 +219,51 @@ def parse_command_line():
                         included in the filename) is automatically incremented over
                         all the videos, across loops.""")
 
+    parser.add_argument("--daemon", action="store_true", default=False,
+                        help="""Run as a long-lived daemon which keeps the device awake with
+                        the camera app open and the scrcpy monitor running, and takes
+                        commands over a Unix socket.  The commands are 'start', 'stop',
+                        'mark', 'status', 'pull' and 'quit'.  They can be sent with the
+                        `--daemon-cmd` option or by writing the command as a line to the
+                        socket, which replies with a line of JSON.""")
+
+    parser.add_argument("--daemon-cmd", type=str, nargs=1, metavar="COMMAND",
+                        default=None, help="""Send a command to a running daemon, print
+                        the reply, and exit.  See the `--daemon` option.""")
+
+    parser.add_argument("--daemon-socket", type=str, nargs=1, metavar="PATH",
+                        default=[DAEMON_SOCKET_PATH], help="""The path of the Unix socket
+                        used by the `--daemon` and `--daemon-cmd` options.  Defaults to
+                        `~/.recdroidvid_daemon.sock`.""")
+
+    parser.add_argument("--continuous", action="store_true", default=False,
+                        help="""Keep the camera app open, the screen awake and the scrcpy
+                        monitor running across takes.  Each time recording is detected
+                        to stop the new videos are pulled and processed, and the program
+                        is then ready for the next take.  Pressing Enter in the terminal
+                        starts or stops recording.  Enter 'q' or close the scrcpy window
+                        to quit.  Numbering is incremented across takes as with the
+                        `--loop` option.""")
+
     parser.add_argument("--autorecord", "-a", action="store_true",
                         default=False, help="""Automatically start recording when the scrcpy
                         monitor starts up.""")
 
+    parser.add_argument("--start-at", type=str, nargs=1, metavar="TIME", default=None,
+                        help="""Start recording at this time of day, given as
+                        HH:MM[:SS[.ffffff]] and optionally preceded by the date as
+                        YYYY-MM-DD.  Everything is set up beforehand, and the record
+                        keyevent is issued early by the measured ADB keyevent latency so
+                        that it lands on the device at the time.  The DAW transport, when
+                        synced, is started at the time too.  The error of the start is
+                        printed, measured from the video file when the `--clock-sync`
+                        option is selected.  Used instead of `--autorecord`.""")
+
+    parser.add_argument("--countdown", type=float, nargs=1, metavar="SECONDS", default=None,
+                        help="""Like `--start-at`, but start recording this many seconds
+                        after the camera app is opened and the latency is measured.  The
+                        last ten seconds are counted down in the terminal.""")
+
     parser.add_argument("--preview-video", "-p", action="store_true",
                         default=False, help="""Preview each video that is downloaded.
                         Currently uses the mpv program.""")
@@ -214,6 +333,84 @@ def parse_command_line():
                         help="""Extract a separate audio file (currently always a WAV file)
                         from each video.""")
 
+    parser.add_argument("--clock-sync", action="store_true", default=False,
+                        help="""Estimate the offset between the device clock and the
+                        computer clock before recording, and use it to map the video
+                        file times on the device to computer time.  The start and stop
+                        times of each take are then printed with error bounds, along
+                        with the detected recording events relative to the start, and
+                        are used for the date and time in video names.""")
+
+    parser.add_argument("--contact-sheets", action="store_true", default=False,
+                        help="""Build a contact sheet image for each pulled video, tiling
+                        evenly spaced keyframes into one image saved next to the video.
+                        The sheets are built in the background while the other processing
+                        continues, and sheets which are already up to date are skipped.""")
+
+    parser.add_argument("--analyze-audio", action="store_true", default=False,
+                        help="""Analyze the extracted audio of each take, computing the peak,
+                        RMS, clipping count, approximate integrated loudness and a
+                        waveform envelope, and print a summary table ranking the clipped
+                        and silent takes first.  Requires audio extraction and the numpy
+                        Python package.""")
+
+    parser.add_argument("--stream-pull", action="store_true", default=False,
+                        help="""Pull videos by streaming them through `adb exec-out` into
+                        preallocated files, computing a SHA-256 checksum of each one
+                        during the transfer.  When audio extraction is selected it is
+                        run right after each transfer, while the video is still in the
+                        page cache, so large videos are not read back from disk.""")
+
+    parser.add_argument("--join-split-segments", action="store_true", default=False,
+                        help="""Join videos which the camera app split into several files
+                        (as OpenCamera does at the file-size limit) back into one video
+                        before numbering.  Consecutive videos are joined when each starts
+                        where the previous one stopped, by the device clock, and their
+                        streams have the same parameters.  The join copies the streams
+                        without re-encoding, and the segment files are deleted after it.""")
+
+    parser.add_argument("--trim-dead-time", action="store_true", default=False,
+                        help="""Trim the dead time at the head and tail of each take:
+                        the recording before the DAW transport was started by the
+                        `--sync-daw-transport-with-video-recording` option, and after the
+                        DAW transport was stopped or the scrcpy monitor was closed.  The
+                        head is cut at the keyframe before the DAW start, so the streams
+                        are copied with no re-encode.  The trim runs before audio
+                        extraction.  Selects the `--clock-sync` option, which it needs to
+                        place the events in the video.""")
+
+    parser.add_argument("--storage-monitor", action="store_true", default=False,
+                        help="""Monitor the free space on the device volume holding the
+                        camera save directory while recording.  The remaining recording
+                        time is estimated from the observed write rate and a warning is
+                        printed when it runs low.  The free space is also shown in the
+                        scrcpy window title.""")
+
+    parser.add_argument("--storage-offload-threshold-mb", type=int, nargs=1,
+                        metavar="INTEGER", default=[0], help="""When the
+                        `--storage-monitor` option is selected and the free space on the
+                        device drops below this many megabytes, finished videos are
+                        pulled and deleted from the device in the background while
+                        recording continues.  The default of zero turns off offloading.""")
+
+    parser.add_argument("--catalog", action="store_true", default=False,
+                        help="""Record every pulled take in a SQLite catalog kept across
+                        sessions, with its prefix, number, times, ffprobe metadata, audio
+                        path, checksum and session ID.  Numbering then resumes from the
+                        catalog unless `--numbering-start` is set.  See the
+                        `--catalog-query` option to query the catalog.""")
+
+    parser.add_argument("--catalog-path", type=str, nargs=1, metavar="PATH",
+                        default=[CATALOG_PATH], help="""The path of the catalog file used
+                        by the `--catalog` option.  Defaults to
+                        `~/.recdroidvid_catalog.sqlite3`.""")
+
+    parser.add_argument("--catalog-query", nargs=argparse.REMAINDER, metavar="QUERY-OPTIONS",
+                        default=None, help="""Query the take catalog, print the matching
+                        takes, and exit.  All the arguments after this option are the
+                        query options, such as `--prefix`, `--since` and `--limit`; run
+                        `recdroidvid --catalog-query --help` to list them.""")
+
     parser.add_argument("--camera-save-dir", "-d", type=str, nargs=1, metavar="DIRPATH",
                         default=[OPENCAMERA_SAVE_DIR], help="""The directory on the remote
                         device where the camera app saves videos.  Record a video and look
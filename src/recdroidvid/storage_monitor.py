@@ -0,0 +1,149 @@
+"""
+
+Monitor the free storage space on the mobile device while recording, and
+offload finished videos in the background when the space runs low.
+
+"""
+
+import sys
+import os
+import threading
+from time import sleep, monotonic
+
+from .settings_and_options import (args, VIDEO_FILE_EXTENSION, STORAGE_MONITOR_SLEEP_TIME,
+                DEFAULT_VIDEO_WRITE_RATE_MB_PER_MIN, MIN_RECORDING_WRITE_RATE_MB_PER_SEC,
+                STORAGE_WARNING_MINUTES)
+from . import adb_commands as adb
+
+storage_monitor_stop_flag = False # Flag to signal the storage monitor thread to stop.
+
+observed_write_rate = None # Observed recording write rate in bytes/sec, kept across loops.
+
+offloaded_video_paths = [] # Remote paths of the videos already pulled while recording.
+offloaded_video_paths_lock = threading.Lock()
+offload_pull_lock = threading.Lock() # Hold while pulling, so a video is not pulled twice.
+
+def write_rate_bytes_per_sec():
+    """Return the observed write rate while recording, or the default rate if
+    none has been observed yet."""
+    if observed_write_rate:
+        return observed_write_rate
+    return DEFAULT_VIDEO_WRITE_RATE_MB_PER_MIN * 1e6 / 60
+
+def estimated_recording_minutes(free_bytes):
+    """Estimate the number of minutes of video that can still be recorded."""
+    return free_bytes / write_rate_bytes_per_sec() / 60
+
+def storage_status_string(free_bytes=None):
+    """Return a short string describing the free space on the device, for use in
+    the scrcpy window title and warnings."""
+    if free_bytes is None:
+        free_bytes = adb.free_space_bytes(args().camera_save_dir[0], print_cmd=False)
+    return (f"device free: {free_bytes/1e9:.1f} GB"
+            f" (~{estimated_recording_minutes(free_bytes):.0f} min)")
+
+def get_offloaded_video_paths():
+    """Return a copy of the list of remote paths of videos offloaded so far."""
+    with offloaded_video_paths_lock:
+        return list(offloaded_video_paths)
+
+def pop_offloaded_video_paths():
+    """Return the list of remote paths of videos offloaded so far, and reset it."""
+    with offloaded_video_paths_lock:
+        video_paths = list(offloaded_video_paths)
+        offloaded_video_paths.clear()
+        return video_paths
+
+def clear_offloaded_video_paths():
+    """Reset the list of offloaded videos; call before each recording loop."""
+    with offloaded_video_paths_lock:
+        offloaded_video_paths.clear()
+
+def offload_finished_videos(before_ls):
+    """Pull and delete the videos that were recorded during this loop and are
+    no longer being written to.  The files in `before_ls` are left alone."""
+    save_dir = args().camera_save_dir[0]
+    with offload_pull_lock:
+        current_ls = adb.ls(save_dir, extension_whitelist=[VIDEO_FILE_EXTENSION],
+                            print_cmd=False)
+        candidates = [f for f in current_ls if f not in before_ls]
+
+        # OpenCamera writes to a hidden `.pending` file, so visible files are finished.  With
+        # other camera apps the newest visible file may still be recording, so skip it.
+        if candidates and not adb.pending_video_file_exists(save_dir):
+            if adb.directory_size_increasing(save_dir):
+                candidates = candidates[:-1]
+
+        for video_file in candidates:
+            video_path = os.path.join(save_dir, video_file)
+            print(f"\nOffloading finished video to free device storage:\n   {video_path}")
+            adb.pull_and_delete_file(video_path)
+            with offloaded_video_paths_lock:
+                offloaded_video_paths.append(video_path)
+
+def storage_monitor_bg_process(stop_flag_fun, before_ls):
+    """Track the free space on the device, updating the observed write rate,
+    warning when little recording time remains, and offloading finished videos
+    when the free space drops below the threshold.  Meant to be run as a thread
+    at the same time as the scrcpy monitor."""
+    global observed_write_rate
+    save_dir = args().camera_save_dir[0]
+    offload_threshold = args().storage_offload_threshold_mb[0] * 1e6
+    prev_free = None
+    prev_time = None
+    last_warning_time = None
+
+    while True:
+        if prev_free is not None: # Check right away the first time.
+            for i in range(STORAGE_MONITOR_SLEEP_TIME): # Sleep in short steps to stop quickly.
+                if stop_flag_fun():
+                    return
+                sleep(1)
+        if stop_flag_fun():
+            return
+        if not adb.feature_available("Storage monitor"): # Paused after ADB failures.
+            prev_free = 0 # Skip the write rate update after the pause.
+            continue
+
+        try:
+            free = adb.free_space_bytes(save_dir, print_cmd=False)
+            now = monotonic()
+            if prev_free: # Not the first check.
+                drop_rate = (prev_free - free) / (now - prev_time)
+                if drop_rate > MIN_RECORDING_WRITE_RATE_MB_PER_SEC * 1e6: # Recording.
+                    if observed_write_rate:
+                        observed_write_rate = 0.5 * observed_write_rate + 0.5 * drop_rate
+                    else:
+                        observed_write_rate = drop_rate
+
+            if estimated_recording_minutes(free) < STORAGE_WARNING_MINUTES:
+                if last_warning_time is None or now - last_warning_time > 60:
+                    print(f"\nWARNING: Device storage is low, {storage_status_string(free)}.",
+                          file=sys.stderr)
+                    last_warning_time = now
+
+            if offload_threshold and free < offload_threshold:
+                offload_finished_videos(before_ls)
+                free = adb.free_space_bytes(save_dir, print_cmd=False)
+        except adb.AdbError as e:
+            adb.record_feature_failure("Storage monitor", e)
+            prev_free = 0
+            continue
+        adb.record_feature_success("Storage monitor")
+        prev_free, prev_time = free, now
+
+def start_storage_monitor(before_ls):
+    """Start up the background thread that monitors the device storage.  The
+    `before_ls` list holds the videos present before recording started."""
+    proc = threading.Thread(target=storage_monitor_bg_process,
+                            args=(lambda: storage_monitor_stop_flag, before_ls))
+    proc.daemon = True # This is so the thread always dies when the main program exits.
+    proc.start()
+    return proc
+
+def storage_monitor_kill(proc):
+    """Stop the storage monitor thread and reclaim resources."""
+    global storage_monitor_stop_flag
+    storage_monitor_stop_flag = True
+    proc.join()
+    storage_monitor_stop_flag = False # Reset for next time.
@@ -0,0 +1,225 @@
+"""
+
+A SQLite catalog of every pulled take, kept across sessions.  Each take is
+recorded with its prefix, number, times, ffprobe metadata, audio path, checksum
+and the ID of the session which pulled it.  The catalog is used to resume the
+numbering for a prefix automatically, and can be queried with the
+`--catalog-query` option.
+
+Each call opens its own connection, so the functions can be used from any
+thread.
+
+"""
+
+import sys
+import os
+import json
+import time
+import datetime
+import sqlite3
+import argparse
+import contextlib
+
+from .settings_and_options import CATALOG_PATH
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS takes (
+    id INTEGER PRIMARY KEY,
+    prefix TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    video_path TEXT NOT NULL,
+    remote_path TEXT,
+    session_id TEXT NOT NULL,
+    taken_at REAL NOT NULL,   -- Unix time of the recording start, or of the pull if unknown.
+    pulled_at REAL NOT NULL,
+    record_start_ns INTEGER,
+    record_stop_ns INTEGER,
+    time_error_ns INTEGER,
+    duration REAL,
+    width INTEGER,
+    height INTEGER,
+    video_codec TEXT,
+    audio_codec TEXT,
+    size INTEGER,
+    bit_rate INTEGER,
+    audio_path TEXT,
+    sha256 TEXT,
+    ffprobe_json TEXT
+);
+CREATE INDEX IF NOT EXISTS takes_prefix_number ON takes (prefix, number);
+CREATE INDEX IF NOT EXISTS takes_prefix_taken_at ON takes (prefix, taken_at);
+CREATE INDEX IF NOT EXISTS takes_taken_at ON takes (taken_at);
+CREATE INDEX IF NOT EXISTS takes_duration ON takes (duration);
+"""
+
+# One ID for all the takes pulled by this run of the program.
+session_id = f"{datetime.datetime.now():%Y%m%d-%H%M%S}-{os.getpid()}"
+
+def catalog_path(path=None):
+    """Return the expanded path of the catalog file, `CATALOG_PATH` by default."""
+    return os.path.abspath(os.path.expanduser(path or CATALOG_PATH))
+
+@contextlib.contextmanager
+def open_catalog(path=None):
+    """Context manager which opens the catalog, creating the table and indexes if
+    needed, and commits and closes it at the end."""
+    conn = sqlite3.connect(catalog_path(path), timeout=30)
+    try:
+        conn.row_factory = sqlite3.Row
+        conn.executescript(SCHEMA)
+        yield conn
+        conn.commit()
+    finally:
+        conn.close()
+
+def next_video_number(prefix, path=None):
+    """Return the number after the highest one cataloged for `prefix`, or 1 if
+    there are none."""
+    with open_catalog(path) as conn:
+        row = conn.execute("SELECT MAX(number) FROM takes WHERE prefix = ?",
+                           (prefix,)).fetchone()
+    return 1 if row[0] is None else row[0] + 1
+
+def ffprobe_columns(metadata):
+    """Return a dict of the catalog columns taken from the parsed ffprobe output."""
+    if not metadata:
+        return {}
+    fmt = metadata.get("format", {})
+    streams = metadata.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    def number(value, to_type):
+        try:
+            return to_type(value)
+        except (TypeError, ValueError):
+            return None
+    return {"duration": number(fmt.get("duration"), float),
+            "size": number(fmt.get("size"), int),
+            "bit_rate": number(fmt.get("bit_rate"), int),
+            "width": video.get("width"),
+            "height": video.get("height"),
+            "video_codec": video.get("codec_name"),
+            "audio_codec": audio.get("codec_name"),
+            "ffprobe_json": json.dumps(metadata)}
+
+def take_columns(metadata):
+    """Return a dict of the catalog columns set from a take metadata dict."""
+    columns = {key: metadata.get(key) for key in ("remote_path", "record_start_ns",
+                                                  "record_stop_ns", "time_error_ns",
+                                                  "duration", "audio_path", "sha256")}
+    columns = {key: value for key, value in columns.items() if value is not None}
+    columns.update({k: v for k, v in ffprobe_columns(metadata.get("ffprobe")).items()
+                         if v is not None})
+    return columns
+
+def add_take(prefix, number, video_path, metadata, path=None):
+    """Add a take to the catalog.  Returns the ID of its row."""
+    pulled_at = time.time()
+    columns = take_columns(metadata)
+    start_ns = columns.get("record_start_ns")
+    columns.update({"prefix": prefix, "number": number,
+                    "video_path": os.path.abspath(video_path), "session_id": session_id,
+                    "taken_at": start_ns / 1e9 if start_ns is not None else pulled_at,
+                    "pulled_at": pulled_at})
+    names = ", ".join(columns)
+    placeholders = ", ".join("?" for c in columns)
+    with open_catalog(path) as conn:
+        cursor = conn.execute(f"INSERT INTO takes ({names}) VALUES ({placeholders})",
+                              list(columns.values()))
+    return cursor.lastrowid
+
+def update_take(take_id, metadata, path=None):
+    """Update the row of a take with any columns now known from its metadata."""
+    columns = take_columns(metadata)
+    if not columns:
+        return
+    assignments = ", ".join(f"{c} = ?" for c in columns)
+    with open_catalog(path) as conn:
+        conn.execute(f"UPDATE takes SET {assignments} WHERE id = ?",
+                     list(columns.values()) + [take_id])
+
+def query_takes(prefix=None, since=None, until=None, min_duration=None,
+                max_duration=None, limit=None, path=None):
+    """Return the cataloged takes matching all the given conditions, ordered by
+    prefix and number.  The times `since` and `until` are Unix times."""
+    conditions = []
+    params = []
+    for condition, value in [("prefix = ?", prefix), ("taken_at >= ?", since),
+                             ("taken_at < ?", until), ("duration >= ?", min_duration),
+                             ("duration <= ?", max_duration)]:
+        if value is not None:
+            conditions.append(condition)
+            params.append(value)
+    query = "SELECT * FROM takes"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY prefix, number, id"
+    if limit is not None:
+        query += " LIMIT ?"
+        params.append(limit)
+    with open_catalog(path) as conn:
+        return conn.execute(query, params).fetchall()
+
+def print_takes(rows):
+    """Print a table of cataloged takes."""
+    print(f"{'prefix':12} {'num':>5}  {'taken at':19} {'dur s':>8} {'WxH':>9}  {'session':22}"
+          f"  video")
+    for row in rows:
+        taken_at = datetime.datetime.fromtimestamp(row["taken_at"]).strftime(
+                                                                   "%Y-%m-%d %H:%M:%S")
+        duration = f"{row['duration']:8.1f}" if row["duration"] is not None else f"{'':8}"
+        dimensions = f"{row['width']}x{row['height']}" if row["width"] is not None else ""
+        print(f"{row['prefix']:12} {row['number']:5d}  {taken_at:19} {duration} {dimensions:>9}"
+              f"  {row['session_id']:22}  {row['video_path']}")
+    print(f"\n{len(rows)} take(s).")
+
+DATE_FORMATS = ["%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M", "%Y-%m-%dT%H:%M:%S",
+                "%Y-%m-%d %H:%M:%S"]
+
+def parse_date(text):
+    """Parse a date or date and time in ISO format to a Unix time, for argparse."""
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.datetime.strptime(text, date_format).timestamp()
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"Not an ISO date or date and time: '{text}'")
+
+def catalog_main(argv):
+    """Run the catalog query of the `--catalog-query` option with the arguments `argv`."""
+    parser = argparse.ArgumentParser(prog="recdroidvid --catalog-query", description=
+                        """Query the catalog of pulled takes.  Takes matching all the
+                        given conditions are printed.""")
+    parser.add_argument("--prefix", type=str, metavar="PREFIXSTRING", default=None,
+                        help="""Only show takes with this video file prefix.""")
+    parser.add_argument("--since", type=parse_date, metavar="DATE", default=None,
+                        help="""Only show takes recorded at or after this date or date and
+                        time, in ISO format (e.g. 2024-05-01 or 2024-05-01T20:00).""")
+    parser.add_argument("--until", type=parse_date, metavar="DATE", default=None,
+                        help="""Only show takes recorded before this date or date and
+                        time, in ISO format.""")
+    parser.add_argument("--min-duration", type=float, metavar="SECONDS", default=None,
+                        help="""Only show takes at least this long.""")
+    parser.add_argument("--max-duration", type=float, metavar="SECONDS", default=None,
+                        help="""Only show takes at most this long.""")
+    parser.add_argument("--limit", type=int, metavar="INTEGER", default=None,
+                        help="""Show at most this many takes.""")
+    parser.add_argument("--next-number", action="store_true", default=False,
+                        help="""Print the next video number for the prefix set by the
+                        `--prefix` option (default "rdv") instead of the takes.""")
+    parser.add_argument("--catalog-path", type=str, metavar="PATH", default=CATALOG_PATH,
+                        help="""The path of the catalog file.  Defaults to
+                        `~/.recdroidvid_catalog.sqlite3`.""")
+    cmd_args = parser.parse_args(argv)
+
+    if not os.path.isfile(catalog_path(cmd_args.catalog_path)):
+        print(f"No catalog at '{catalog_path(cmd_args.catalog_path)}'.", file=sys.stderr)
+        sys.exit(1)
+    if cmd_args.next_number:
+        print(next_video_number(cmd_args.prefix or "rdv", cmd_args.catalog_path))
+        return
+    rows = query_takes(prefix=cmd_args.prefix, since=cmd_args.since, until=cmd_args.until,
+                       min_duration=cmd_args.min_duration,
+                       max_duration=cmd_args.max_duration, limit=cmd_args.limit,
+                       path=cmd_args.catalog_path)
+    print_takes(rows)
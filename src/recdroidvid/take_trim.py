@@ -0,0 +1,105 @@
+"""
+
+Trim the dead time at the head and tail of a take, losslessly.  The head is the
+recording before the DAW transport was started, since the DAW sync only sees
+recording start on its next poll.  The tail is the recording after the DAW
+transport was stopped or the scrcpy monitor was closed, while the program waits
+for the camera to stop.
+
+The cuts use the host times of the logged recording events mapped onto the
+video by its clock-synced start time, widened by the error bounds and
+`TRIM_MARGIN`.  The head cut is moved back to the keyframe before it, so the
+streams can be copied with no re-encode.
+
+"""
+
+import sys
+import os
+import json
+
+from .settings_and_options import TRIM_MARGIN, TRIM_MIN_SECONDS
+from .utility_functions import run_local_cmd_blocking, video_duration, file_sha256
+
+HEAD_EVENTS = ["daw_start"] # Events after which a take is live.
+TAIL_EVENTS = ["daw_stop", "monitor_closed"] # Events after which a take is dead.
+
+def keyframe_times(video_path):
+    """Return the sorted times in seconds of the keyframes of the first video stream,
+    from the packet flags (nothing is decoded), or `None` if ffprobe fails."""
+    cmd = ["ffprobe", "-v", "error", "-select_streams", "v:0", "-show_entries",
+           "packet=pts_time,flags:format=start_time", "-of", "json", video_path]
+    returncode, stdout, stderr = run_local_cmd_blocking(cmd, fail_on_nonzero_exit=False)
+    if returncode != 0:
+        return None
+    try:
+        probe = json.loads(stdout)
+        start_time = float(probe.get("format", {}).get("start_time", 0))
+        return sorted(float(p["pts_time"]) - start_time for p in probe["packets"]
+                      if "K" in p.get("flags", "") and p.get("pts_time") not in (None, "N/A"))
+    except (ValueError, KeyError):
+        return None
+
+def live_window(metadata, record_events):
+    """Return the tuple `(head, tail)` of the times in seconds, in the video, of the
+    first head event and the first later tail event during the take, widened by the
+    error bounds.  The head is 0 and the tail the duration if there is no such event."""
+    start_ns, stop_ns = metadata["record_start_ns"], metadata["record_stop_ns"]
+    slack_ns = metadata["time_error_ns"] + int(TRIM_MARGIN * 1e9)
+    head_times = [e["earliest_ns"] for e in record_events
+                  if e["event"] in HEAD_EVENTS and start_ns < e["earliest_ns"] < stop_ns]
+    head_ns = min(head_times) - slack_ns if head_times else start_ns
+    tail_times = [e["latest_ns"] for e in record_events if e["event"] in TAIL_EVENTS
+                                           and max(start_ns, head_ns) < e["latest_ns"] < stop_ns]
+    tail_ns = min(tail_times) + slack_ns if tail_times else stop_ns
+    return max(0, (head_ns - start_ns) / 1e9), (min(tail_ns, stop_ns) - start_ns) / 1e9
+
+def cut_video(video_path, head, tail):
+    """Cut the video at `video_path` in place to the times from `head`, which must
+    be a keyframe, to `tail` seconds, copying the streams.  Returns true on success."""
+    root_name, video_extension = os.path.splitext(video_path)
+    tmp_path = root_name + ".trim_tmp" + video_extension # Written then renamed.
+    cmd = ["ffmpeg", "-y", "-loglevel", "error", "-ss", f"{head:.6f}", "-i", video_path,
+           "-t", f"{tail - head:.6f}", "-map", "0", "-c", "copy",
+           "-avoid_negative_ts", "make_zero", tmp_path]
+    returncode, stdout, stderr = run_local_cmd_blocking(cmd, print_cmd=True,
+                                       print_cmd_prefix="SYSTEM: ", fail_on_nonzero_exit=False)
+    if returncode != 0 or not os.path.isfile(tmp_path):
+        print(f"\nWARNING: Trimming '{video_path}' failed, leaving it untrimmed:\n{stderr}",
+              file=sys.stderr)
+        if os.path.isfile(tmp_path):
+            os.remove(tmp_path)
+        return False
+    os.replace(tmp_path, video_path)
+    return True
+
+def trim_take(video_path, metadata, record_events):
+    """Trim the dead head and tail of the take at `video_path`, updating its metadata
+    dict for the trimmed video.  Returns true if the video was trimmed."""
+    if "record_start_ns" not in metadata:
+        print(f"\nWARNING: The take times of '{video_path}' are unknown, not trimming it.",
+              file=sys.stderr)
+        return False
+    duration = metadata["duration"]
+    head, tail = live_window(metadata, record_events)
+    keyframes = keyframe_times(video_path)
+    if not keyframes:
+        print(f"\nWARNING: Could not find the keyframes of '{video_path}', not trimming it.",
+              file=sys.stderr)
+        return False
+    head = max([k for k in keyframes if k <= head] or [0.0])
+    if tail <= head or head + (duration - tail) < TRIM_MIN_SECONDS:
+        return False
+
+    print(f"\nTrimming {head:.2f} s of pre-roll and {duration - tail:.2f} s of post-roll"
+          f" from '{video_path}'.")
+    if not cut_video(video_path, head, tail):
+        return False
+    new_duration = video_duration(video_path) or tail - head
+    metadata["trimmed_head"] = head
+    metadata["trimmed_tail"] = duration - head - new_duration
+    metadata["record_start_ns"] += int(head * 1e9)
+    metadata["record_stop_ns"] = metadata["record_start_ns"] + int(new_duration * 1e9)
+    metadata["duration"] = new_duration
+    if metadata.get("sha256"): # Checksums were wanted, so make one for the trimmed file.
+        metadata["sha256"] = file_sha256(video_path)
+    return True
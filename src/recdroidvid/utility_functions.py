@@ -5,6 +5,10 @@ Simple utility functions used in multiple modules.
 """
 
 import sys
+import os
+import json
+import hashlib
+import signal
 import subprocess
 
 def query_yes_no(query_string, empty_default=None):
@@ -27,7 +31,7 @@ def query_yes_no(query_string, empty_default=None):
         return False # Must be a "no" or "quit" answer.
 
 def run_local_cmd_blocking(cmd, *, print_cmd=False, print_cmd_prefix="", macro_dict={},
-                           fail_on_nonzero_exit=True, capture_output=True):
+                           fail_on_nonzero_exit=True, capture_output=True, timeout=None):
     """Run a local system command.  If a string is passed in as `cmd` then
     `shell=True` is assumed.  If `macro_dict` is passed in then any dict key
     strings found as substrings of `cmd` will be replaced by their corresponding
@@ -37,6 +41,10 @@ def run_local_cmd_blocking(cmd, *, print_cmd=False, print_cmd_prefix="", macro_d
     returned argument.  Otherwise only stdout and stderr are returned, assuming
     `capture_output` is true.
 
+    If `timeout` is set to a number of seconds the command (along with any
+    processes it started) is killed if it runs longer, and the return code is
+    `None`.
+
     Note that when `capture_output` is false the process output goes to the
     terminal as it runs, otherwise it doesn't."""
     shell = False
@@ -54,19 +62,35 @@ def run_local_cmd_blocking(cmd, *, print_cmd=False, print_cmd_prefix="", macro_d
         cmd_string = "\n" + print_cmd_prefix + cmd_string
         print(cmd_string)
 
-    completed_process = subprocess.run(cmd, capture_output=capture_output, shell=shell,
-                                       check=False, encoding="utf-8")
+    pipe = subprocess.PIPE if capture_output else None
+    # With a timeout, a new session puts the command and any children in their own
+    # process group so they can all be killed (killing just a shell can leave a child
+    # holding the output pipes open).
+    process = subprocess.Popen(cmd, stdout=pipe, stderr=pipe, shell=shell,
+                               encoding="utf-8", start_new_session=timeout is not None)
+    try:
+        stdout, stderr = process.communicate(timeout=timeout)
+        returncode = process.returncode
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+        stdout, stderr = process.communicate()
+        stderr = (stderr or "") + f"\nCommand timed out after {timeout} seconds."
+        returncode = None
+    except KeyboardInterrupt:
+        if timeout is not None: # The new session does not get the terminal's Ctrl-C.
+            os.killpg(process.pid, signal.SIGTERM)
+        raise
 
-    if fail_on_nonzero_exit and completed_process.returncode != 0:
+    if fail_on_nonzero_exit and returncode != 0:
         print("\nError, nonzero exit running system command, exiting...", file=sys.stderr)
         sys.exit(1)
 
     if capture_output:
         if fail_on_nonzero_exit:
-            return completed_process.stdout, completed_process.stderr
-        return completed_process.returncode, completed_process.stdout, completed_process.stderr
+            return stdout, stderr
+        return returncode, stdout, stderr
     if not fail_on_nonzero_exit:
-        return completed_process.returncode
+        return returncode
 
 def indent_lines(string, n=4):
     """Indent all the lines in a string by n spaces."""
@@ -74,3 +98,33 @@ def indent_lines(string, n=4):
     string_list = [" "*n + i for i in string_list]
     return "\n".join(string_list)
 
+
+def ffprobe_metadata(video_path):
+    """Return the ffprobe format and stream information for a video as a dict
+    parsed from ffprobe's JSON output, or `None` if ffprobe fails."""
+    cmd = ["ffprobe", "-v", "error", "-print_format", "json", "-show_format",
+           "-show_streams", video_path]
+    returncode, stdout, stderr = run_local_cmd_blocking(cmd, fail_on_nonzero_exit=False)
+    if returncode != 0:
+        return None
+    try:
+        return json.loads(stdout)
+    except ValueError:
+        return None
+
+def video_duration(video_path):
+    """Return the duration of a video in seconds from ffprobe, or `None` if it
+    cannot be found."""
+    metadata = ffprobe_metadata(video_path)
+    try:
+        return float(metadata["format"]["duration"])
+    except (TypeError, KeyError, ValueError):
+        return None
+
+def file_sha256(path, block_size=8*1024*1024):
+    """Return the hex digest of the SHA-256 checksum of the file at `path`."""
+    checksum = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            checksum.update(block)
+    return checksum.hexdigest()